@@ -0,0 +1,107 @@
+"""
+Cold-start benchmark: how long a fresh container takes to import the app and to answer its first request.
+
+    python -m benchmarks.cold_start --runs 5 --output cold_start.json
+
+Import time is measured in a fresh interpreter per run; time-to-first-request spawns uvicorn and polls a
+Mongo-backed route until it answers, so it includes the lifespan's connection setup and prompt compilation.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+import httpx
+
+from benchmarks.fakes import BackgroundServer, fake_blob_app, fake_openai_app
+from benchmarks.run import _git_revision, configure_environment
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+IMPORT_SNIPPET = ("import sys, time; start = time.perf_counter(); import main; "
+                  "sys.stdout.write(str(time.perf_counter() - start))")
+
+
+def measure_import(env: dict) -> float:
+    output = subprocess.check_output([sys.executable, "-c", IMPORT_SNIPPET], cwd=REPO_ROOT, env=env, text=True)
+    return float(output.strip().splitlines()[-1])
+
+
+def slowest_imports(env: dict, top: int = 10) -> list:
+    """
+    Runs python -X importtime once and returns the modules with the largest cumulative import time
+    """
+    completed = subprocess.run([sys.executable, "-X", "importtime", "-c", "import main"], cwd=REPO_ROOT, env=env,
+                               capture_output=True, text=True)
+    rows = []
+    for line in completed.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative_us, module = line[len("import time:"):].split("|")
+        rows.append({"module": module.strip(), "cumulative_ms": int(cumulative_us) / 1000})
+    rows.sort(key=lambda row: row["cumulative_ms"], reverse=True)
+    return rows[:top]
+
+
+def measure_first_request(env: dict, port: int, timeout: float = 60.0) -> float:
+    start = time.perf_counter()
+    process = subprocess.Popen([sys.executable, "-m", "uvicorn", "main:app", "--port", str(port),
+                                "--log-level", "warning"], cwd=REPO_ROOT, env=env)
+    url = f"http://127.0.0.1:{port}/mongo/read_user_info_from_mongo/cold@example.com"
+    try:
+        while time.perf_counter() - start < timeout:
+            try:
+                response = httpx.get(url, params={"email_id": "cold@example.com"}, timeout=5)
+                if response.status_code < 500:
+                    return time.perf_counter() - start
+            except httpx.TransportError:
+                pass
+            time.sleep(0.01)
+        raise TimeoutError(f"App did not answer within {timeout}s")
+    finally:
+        process.terminate()
+        process.wait(timeout=10)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--mongo-uri", default="mongomock://localhost")
+    parser.add_argument("--port", type=int, default=18090)
+    parser.add_argument("--openai-port", type=int, default=18082)
+    parser.add_argument("--blob-port", type=int, default=18083)
+    parser.add_argument("--output", help="Write the JSON report here")
+    args = parser.parse_args(argv)
+
+    openai_server = BackgroundServer(fake_openai_app(), args.openai_port).start()
+    blob_server = BackgroundServer(fake_blob_app(), args.blob_port).start()
+    configure_environment(args.mongo_uri, openai_server.url, blob_server.url)
+    env = dict(os.environ)
+    try:
+        import_times = [measure_import(env) for _ in range(args.runs)]
+        first_request_times = [measure_first_request(env, args.port) for _ in range(args.runs)]
+        top_imports = slowest_imports(env)
+    finally:
+        openai_server.stop()
+        blob_server.stop()
+
+    report = {
+        "revision": _git_revision(),
+        "runs": args.runs,
+        "import_ms": {"median": round(statistics.median(import_times) * 1000, 1),
+                      "max": round(max(import_times) * 1000, 1)},
+        "time_to_first_request_ms": {"median": round(statistics.median(first_request_times) * 1000, 1),
+                                     "max": round(max(first_request_times) * 1000, 1)},
+        "slowest_imports": top_imports,
+    }
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,147 @@
+"""
+Encode time and payload size of the response formats offered by settings.encoding, measured on a realistic
+weekly meal_data document and a chat_data document holding a 200-turn history.
+
+    python -m benchmarks.encoding_bench
+"""
+import argparse
+import gzip
+import json
+import random
+import sys
+import timeit
+
+import brotli
+import msgpack
+import orjson
+
+from benchmarks.run import _git_revision
+from settings.encoding import BROTLI_QUALITY, GZIP_LEVEL
+
+DAYS = ["day1", "day2", "day3", "day4", "day5", "day6", "day7"]
+DISHES = {
+    "breakfast": ["vegetable poha with peanuts and curry leaves 320 calorie",
+                  "masala oats with carrots and peas 290 calorie",
+                  "moong dal chilla with mint chutney 310 calorie"],
+    "lunch": ["rajma chawal with cucumber raita 610 calorie",
+              "grilled paneer wrap with whole wheat roti 540 calorie",
+              "chicken curry with brown rice and salad 650 calorie"],
+    "dinner": ["palak tofu with two multigrain rotis 480 calorie",
+               "dal tadka with jeera rice and sauteed beans 520 calorie",
+               "tandoori fish with quinoa pulao 560 calorie"],
+}
+
+
+def meal_document() -> dict:
+    meal = {day: {slot: options[index % len(options)] for slot, options in DISHES.items()}
+            for index, day in enumerate(DAYS)}
+    return {"email_id": "priya.sharma@example.com", "meal": meal, "etag": "5f0c3c1f7fa84d7c9a56a7c1b37c9c1e"}
+
+
+FOODS = ["rajma chawal", "paneer tikka", "masala dosa", "chole bhature", "aloo paratha", "dal makhani",
+         "vegetable biryani", "idli sambar", "egg bhurji", "fish curry", "poha", "upma", "khichdi", "pav bhaji",
+         "chicken tikka", "greek yogurt", "quinoa salad", "sprouts chaat", "oats porridge", "banana smoothie"]
+QUESTIONS = [
+    "Can I swap the {food} on day {day} for something with less carbs but similar protein?",
+    "How many calories are in {grams} g of {food}?",
+    "I ate {food} and {other} for lunch today, am I still under my {goal} calorie goal?",
+    "Is {food} okay for dinner if I want to lose {kilos} kg by next month?",
+    "What can I add to {food} to get {protein} g more protein?",
+    "My weight went from {weight} kg to {weight2} kg this week, should I change my plan?",
+]
+SENTENCES = [
+    "{food} has roughly {calories} calories and {protein} g of protein per serving.",
+    "You could replace it with {other}, which keeps the protein while cutting about {carbs} g of carbohydrates.",
+    "Try pairing it with a bowl of {other} and a glass of buttermilk to stay close to your {goal} calorie goal.",
+    "A portion of {grams} g fits your plan for day {day} if you skip the evening snack.",
+    "Aim for {water} litres of water and {steps} steps a day alongside the meal plan.",
+    "Small fluctuations of {kilos} kg are normal, look at the trend over two or three weeks.",
+    "Adding {grams} g of paneer or two boiled eggs brings it up by roughly {protein} g of protein.",
+    "Season it with lemon, chaat masala and fresh coriander instead of extra oil or butter.",
+    "Your current plan averages {goal} calories with {protein} g of protein, which suits a gentle deficit.",
+]
+
+
+def chat_history(turns: int = 200) -> str:
+    """
+    Varied turns serialised the way routers.ai_gpt stores them in chat_data, a JSON string of message/response pairs
+    """
+    rng = random.Random(7)
+
+    def values() -> dict:
+        food, other = rng.sample(FOODS, 2)
+        weight = rng.randint(55, 95)
+        return {"food": food, "other": other, "day": rng.randint(1, 7), "grams": rng.randrange(50, 400, 10),
+                "goal": rng.randrange(1400, 2600, 50), "kilos": rng.randint(1, 6), "protein": rng.randint(5, 40),
+                "calories": rng.randint(80, 750), "carbs": rng.randint(10, 80), "water": rng.choice([2, 2.5, 3]),
+                "steps": rng.randrange(6000, 12000, 500), "weight": weight, "weight2": weight + rng.choice([-2, -1, 1])}
+
+    history = []
+    for _ in range(turns):
+        message = rng.choice(QUESTIONS).format(**values())
+        sentences = [sentence.format(**values()) for sentence in rng.sample(SENTENCES, rng.randint(2, 5))]
+        response = " ".join(sentence[0].upper() + sentence[1:] for sentence in sentences)
+        history.append({"message": message, "response": response})
+    return json.dumps(history)
+
+
+def chat_document(turns: int = 200) -> dict:
+    return {"email_id": "priya.sharma@example.com", "history": chat_history(turns)}
+
+
+def stdlib_json(content) -> bytes:
+    # Mirrors starlette.responses.JSONResponse.render
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode()
+
+
+ENCODERS = {
+    "json (stdlib)": stdlib_json,
+    "orjson": orjson.dumps,
+    "msgpack": msgpack.packb,
+}
+COMPRESSORS = {
+    "identity": lambda body: body,
+    f"gzip-{GZIP_LEVEL}": lambda body: gzip.compress(body, compresslevel=GZIP_LEVEL),
+    f"br-{BROTLI_QUALITY}": lambda body: brotli.compress(body, quality=BROTLI_QUALITY),
+    "br-11": lambda body: brotli.compress(body, quality=11),
+}
+
+
+def _best_of(fn, number: int) -> float:
+    return min(timeit.repeat(fn, number=number, repeat=5)) / number
+
+
+def bench(name: str, content, number: int) -> list:
+    rows = []
+    for encoder_name, encoder in ENCODERS.items():
+        body = encoder(content)
+        encode_us = _best_of(lambda: encoder(content), number) * 1e6
+        for compressor_name, compressor in COMPRESSORS.items():
+            compressed = compressor(body)
+            compress_us = _best_of(lambda: compressor(body), max(1, number // 10)) * 1e6
+            rows.append({"payload": name, "encoder": encoder_name, "compression": compressor_name,
+                         "bytes": len(compressed), "encode_us": round(encode_us, 1),
+                         "compress_us": round(compress_us, 1), "total_us": round(encode_us + compress_us, 1)})
+    return rows
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--number", type=int, default=500, help="Encodes per timing sample")
+    parser.add_argument("--output", help="Write the JSON report here")
+    args = parser.parse_args(argv)
+
+    rows = bench("meal_data", meal_document(), args.number) + bench("chat_data_200", chat_document(), args.number)
+    print(f"{'payload':18s} {'encoder':14s} {'compression':12s} {'bytes':>8s} {'encode us':>10s} "
+          f"{'compress us':>12s} {'total us':>10s}")
+    for row in rows:
+        print(f"{row['payload']:18s} {row['encoder']:14s} {row['compression']:12s} {row['bytes']:>8d} "
+              f"{row['encode_us']:>10.1f} {row['compress_us']:>12.1f} {row['total_us']:>10.1f}")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"revision": _git_revision(), "results": rows}, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
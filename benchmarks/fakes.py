@@ -0,0 +1,184 @@
+"""
+Local stand-ins for the external services the app talks to, so benchmarks can run offline:
+
+* a fake OpenAI server answering /v1/chat/completions with configurable latency and optional SSE streaming
+* a fake Azure Blob endpoint accepting container creation and blob uploads in memory
+
+Both are small Starlette apps served by uvicorn on a background thread.
+"""
+import asyncio
+import json
+import logging
+import threading
+import time
+import uuid
+from email.utils import formatdate
+
+import uvicorn
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Route
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+MEAL_RESPONSE = json.dumps({
+    f"day{day}": {"breakfast": "oatmeal with berries 350 calorie",
+                  "lunch": "grilled chicken salad 550 calorie",
+                  "dinner": "paneer tikka with rice 700 calorie"}
+    for day in range(1, 8)
+})
+GROCERY_RESPONSE = "eggs 1 tray, oats 1 kg, berries 2 pack, chicken 1 kg, lettuce 2 head, paneer 500 g, rice 2 kg"
+RECOMMENDATION_RESPONSE = ("Aim for 1.6 g of protein per kg of body weight, strength train three times a week "
+                           "and keep daily intake close to your calorie goal.")
+CHAT_RESPONSE = "The paneer tikka takes about 30 minutes to prepare, including 15 minutes of marination."
+VISION_CALORIE_RESPONSE = "450"
+VISION_NAME_RESPONSE = "Paneer Tikka"
+
+
+def _prompt_text(body: dict) -> str:
+    parts = []
+    for message in body.get("messages", []):
+        content = message.get("content")
+        if isinstance(content, str):
+            parts.append(content)
+        elif isinstance(content, list):
+            parts.extend(item.get("text", "") for item in content if item.get("type") == "text")
+    return " ".join(parts)
+
+
+def _canned_answer(prompt: str) -> str:
+    if "Calorie value of this food item" in prompt:
+        return VISION_CALORIE_RESPONSE
+    if "Food Item in this image" in prompt:
+        return VISION_NAME_RESPONSE
+    if "Meal generator" in prompt:
+        return MEAL_RESPONSE
+    if "Grocery list generator" in prompt:
+        return GROCERY_RESPONSE
+    if "Recommendation generator" in prompt:
+        return RECOMMENDATION_RESPONSE
+    return CHAT_RESPONSE
+
+
+def fake_openai_app(latency: float = 0.5, token_latency: float = 0.0) -> Starlette:
+    """
+    Builds a fake OpenAI chat completions API
+    :param latency: Seconds to wait before the first byte of every completion
+    :param token_latency: Seconds between streamed chunks when the client asks for stream=true
+    :return: Starlette app
+    """
+
+    async def chat_completions(request: Request):
+        body = await request.json()
+        prompt = _prompt_text(body)
+        answer = _canned_answer(prompt)
+        model = body.get("model", "gpt-4o")
+        prompt_tokens = max(1, len(prompt) // 4)
+        completion_tokens = max(1, len(answer) // 4)
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        created = int(time.time())
+        await asyncio.sleep(latency)
+
+        if body.get("stream"):
+            async def chunks():
+                words = answer.split(" ")
+                for index, word in enumerate(words):
+                    delta = {"content": word if index == 0 else " " + word}
+                    if index == 0:
+                        delta["role"] = "assistant"
+                    chunk = {"id": completion_id, "object": "chat.completion.chunk", "created": created,
+                             "model": model, "choices": [{"index": 0, "delta": delta, "finish_reason": None}]}
+                    yield f"data: {json.dumps(chunk)}\n\n"
+                    if token_latency:
+                        await asyncio.sleep(token_latency)
+                done = {"id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                        "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]}
+                yield f"data: {json.dumps(done)}\n\n"
+                yield "data: [DONE]\n\n"
+
+            return StreamingResponse(chunks(), media_type="text/event-stream")
+
+        return JSONResponse({
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": created,
+            "model": model,
+            "choices": [{"index": 0, "finish_reason": "stop",
+                         "message": {"role": "assistant", "content": answer}}],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                      "total_tokens": prompt_tokens + completion_tokens},
+        })
+
+    return Starlette(routes=[Route("/v1/chat/completions", chat_completions, methods=["POST"])])
+
+
+def fake_blob_app(latency: float = 0.05) -> Starlette:
+    """
+    Builds a minimal Azure Blob Storage stand-in. Containers and blobs are kept in memory.
+    Account URL to configure: http://127.0.0.1:<port>/devstoreaccount1
+    :param latency: Seconds to wait on every storage call
+    :return: Starlette app
+    """
+    containers = {}
+
+    def _headers() -> dict:
+        return {"ETag": f'"0x{uuid.uuid4().hex[:16].upper()}"',
+                "Last-Modified": formatdate(usegmt=True),
+                "x-ms-request-id": str(uuid.uuid4()),
+                "x-ms-version": "2023-11-03",
+                "Date": formatdate(usegmt=True)}
+
+    async def container(request: Request):
+        await asyncio.sleep(latency)
+        name = request.path_params["container"]
+        if request.method == "PUT":
+            if name in containers:
+                return Response(status_code=409, headers={"x-ms-error-code": "ContainerAlreadyExists"})
+            containers[name] = {}
+            return Response(status_code=201, headers=_headers())
+        if request.method == "DELETE":
+            if containers.pop(name, None) is None:
+                return Response(status_code=404, headers={"x-ms-error-code": "ContainerNotFound"})
+            return Response(status_code=202, headers=_headers())
+        return Response(status_code=200 if name in containers else 404, headers=_headers())
+
+    async def blob(request: Request):
+        await asyncio.sleep(latency)
+        name = request.path_params["container"]
+        blob_name = request.path_params["blob"]
+        if request.method == "PUT":
+            containers.setdefault(name, {})[blob_name] = await request.body()
+            return Response(status_code=201, headers=_headers())
+        data = containers.get(name, {}).get(blob_name)
+        if data is None:
+            return Response(status_code=404, headers={"x-ms-error-code": "BlobNotFound"})
+        return Response(content=data, status_code=200, headers=_headers())
+
+    return Starlette(routes=[
+        Route("/{account}/{container}", container, methods=["PUT", "DELETE", "GET", "HEAD"]),
+        Route("/{account}/{container}/{blob:path}", blob, methods=["PUT", "GET", "HEAD"]),
+    ])
+
+
+class BackgroundServer:
+    """
+    Runs an ASGI app with uvicorn on a daemon thread
+    """
+
+    def __init__(self, app, port: int, host: str = "127.0.0.1"):
+        self.url = f"http://{host}:{port}"
+        self.server = uvicorn.Server(uvicorn.Config(app, host=host, port=port, log_level="warning"))
+        self.thread = threading.Thread(target=self.server.run, daemon=True)
+
+    def start(self) -> "BackgroundServer":
+        self.thread.start()
+        while not self.server.started:
+            time.sleep(0.01)
+        logger.info(f"Stand-in listening on {self.url}")
+        return self
+
+    def stop(self) -> None:
+        self.server.should_exit = True
+        self.thread.join(timeout=5)
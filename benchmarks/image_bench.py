@@ -0,0 +1,97 @@
+"""
+Bytes and latency saved per image by the pre-processing stage in settings.images.
+
+Generates phone-sized synthetic photos, runs preprocess_image on them and reports the stored size, thumbnail
+size, processing time, the estimated upload time at a given uplink and the vision prompt tokens billed for the
+original versus the processed image.
+
+    python -m benchmarks.image_bench --uplink-mbps 20
+"""
+import argparse
+import io
+import json
+import math
+import statistics
+import sys
+import time
+
+from benchmarks.run import _git_revision
+from settings.images import IMAGE_FORMAT, IMAGE_MAX_EDGE, preprocess_image
+
+PHONE_SIZES = [(4032, 3024), (3024, 4032), (4000, 2250), (1920, 1080)]
+
+
+def synthetic_photo(width: int, height: int, seed: int) -> bytes:
+    """
+    A noisy, gradient-filled JPEG so that the encoder cannot cheat on flat colour
+    """
+    from PIL import Image, ImageFilter
+
+    noise = Image.effect_noise((width // 4, height // 4), 64 + seed).resize((width, height))
+    gradient = Image.linear_gradient("L").resize((width, height))
+    image = Image.merge("RGB", (noise, gradient, noise.filter(ImageFilter.GaussianBlur(3))))
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=92)
+    return buffer.getvalue()
+
+
+def vision_tokens(width: int, height: int, detail: str) -> int:
+    """
+    OpenAI's published image token formula for gpt-4o class models
+    """
+    if detail == "low":
+        return 85
+    scale = min(1.0, 2048 / max(width, height))
+    width, height = width * scale, height * scale
+    scale = min(1.0, 768 / min(width, height))
+    width, height = width * scale, height * scale
+    return 85 + 170 * math.ceil(width / 512) * math.ceil(height / 512)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--uplink-mbps", type=float, default=20.0, help="Server to Azure/OpenAI bandwidth")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", help="Write the JSON report here")
+    args = parser.parse_args(argv)
+
+    rows = []
+    for index, (width, height) in enumerate(PHONE_SIZES):
+        raw = synthetic_photo(width, height, index)
+        timings = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            processed = preprocess_image(raw)
+            timings.append(time.perf_counter() - start)
+        seconds_per_byte = 8 / (args.uplink_mbps * 1e6)
+        rows.append({
+            "source": f"{width}x{height}",
+            "processed": f"{processed.width}x{processed.height}",
+            "original_bytes": len(raw),
+            "processed_bytes": len(processed.data),
+            "thumbnail_bytes": len(processed.thumbnail),
+            "bytes_saved": len(raw) - len(processed.data) - len(processed.thumbnail),
+            "processing_ms": round(statistics.median(timings) * 1000, 1),
+            "upload_ms_original": round(len(raw) * seconds_per_byte * 1000, 1),
+            "upload_ms_processed": round((len(processed.data) + len(processed.thumbnail)) * seconds_per_byte * 1000,
+                                         1),
+            "vision_tokens_original": vision_tokens(width, height, "high") * 2,
+            "vision_tokens_processed": vision_tokens(processed.width, processed.height, processed.detail) * 2,
+        })
+
+    print(f"format={IMAGE_FORMAT} max_edge={IMAGE_MAX_EDGE} uplink={args.uplink_mbps} Mbps "
+          f"(vision tokens cover both calls of get_calorie_value)")
+    for row in rows:
+        print(f"{row['source']:>10s} -> {row['processed']:>9s}  {row['original_bytes']:>9d} B -> "
+              f"{row['processed_bytes']:>7d} B (+{row['thumbnail_bytes']} B thumb)  "
+              f"process {row['processing_ms']:>6.1f} ms  upload {row['upload_ms_original']:>7.1f} -> "
+              f"{row['upload_ms_processed']:>6.1f} ms  tokens {row['vision_tokens_original']} -> "
+              f"{row['vision_tokens_processed']}")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"revision": _git_revision(), "results": rows}, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,343 @@
+"""
+Query plan audit for the MongoDB access paths of the routers.
+
+Seeds a scratch database on a local mongod with synthetic users, creates the indexes the app creates at startup,
+runs `explain` (executionStats) for every query shape the routers issue and reports collection scans,
+docs examined per doc returned and filters no index serves. Exits 1 when a shape has a problem that is not
+accepted in the baseline, so it can gate CI.
+
+    python -m benchmarks.query_audit --mongo-uri mongodb://localhost:27017
+    python -m benchmarks.query_audit --write-baseline benchmarks/query_audit_baseline.json
+    python -m benchmarks.query_audit --baseline benchmarks/query_audit_baseline.json --output audit.json
+
+Use --no-seed --database <name> to audit an existing database (explain never modifies data). Without --no-seed
+only a database the audit created itself is seeded and dropped, any other existing database is refused.
+mongomock cannot explain, this needs a real mongod.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+from datetime import date, datetime, timedelta, timezone
+from typing import NamedTuple
+
+import pymongo
+from pymongo.errors import PyMongoError
+
+from benchmarks.run import USER_PROFILE
+
+# Collection written first into every database the audit seeds; only databases holding it are ever dropped
+SCRATCH_MARKER = "query_audit_scratch"
+
+
+class QueryShape(NamedTuple):
+    name: str
+    source: str
+    collection: str
+    # Explainable command document, e.g. {"find": ..., "filter": ...}
+    command: dict
+
+
+def query_shapes(email: str, today: str, week_ago: str) -> list:
+    """
+    Every query shape issued by the routers and the retention job, with concrete values for one user
+    """
+    from routers.calorie import weekly_calorie_pipeline
+    from routers.dashboard import calorie_summary_pipeline
+    from routers.mongo_crud_data import VERSIONED_COLLECTIONS
+    from settings.retention import CALORIE_DAILY_COLLECTION, RETENTION_BATCH_SIZE, rollup_claim_pipeline
+
+    shapes = [
+        QueryShape(f"{name}.find_one_by_email", "mongo_crud_data.load_versioned / load_etag", name,
+                   {"find": name, "filter": {"email_id": email}, "projection": {"_id": 0, "etag": 1}, "limit": 1,
+                    "singleBatch": True})
+        for name in VERSIONED_COLLECTIONS
+    ]
+    shapes += [
+        QueryShape("nutrition_app_user.upsert_by_email", "mongo_crud_data.write_user_info_to_mongo",
+                   "nutrition_app_user",
+                   {"update": "nutrition_app_user",
+                    "updates": [{"q": {"email_id": email}, "u": {"$set": {"etag": "x"}}, "upsert": True}]}),
+        QueryShape("nutrition_app_user.delete_by_email", "mongo_crud_data.delete_user_info_from_mongo",
+                   "nutrition_app_user",
+                   {"delete": "nutrition_app_user", "deletes": [{"q": {"email_id": email}, "limit": 0}]}),
+        QueryShape("chat_data.find_by_email", "mongo_crud_data.get_all_chats", "chat_data",
+                   {"find": "chat_data", "filter": {"email_id": email}, "projection": {"_id": 0}}),
+        QueryShape("chat_data.update_by_email", "mongo_crud_data.save_chat", "chat_data",
+                   {"update": "chat_data",
+                    "updates": [{"q": {"email_id": email}, "u": {"$set": {"history": "x"}}}]}),
+        QueryShape("calorie_data.find_by_email_and_date", "calorie.get_total_calorie_by_date", "calorie_data",
+                   {"find": "calorie_data", "filter": {"email_id": email, "date": today}}),
+        QueryShape("calorie_data.find_one_by_email", "calorie.get_total_calorie_by_date", "calorie_data",
+                   {"find": "calorie_data", "filter": {"email_id": email}, "projection": {"_id": 1}, "limit": 1,
+                    "singleBatch": True}),
+        QueryShape(f"{CALORIE_DAILY_COLLECTION}.find_one_by_email_and_date",
+                   "retention.load_daily_total (calorie.get_total_calorie_by_date)", CALORIE_DAILY_COLLECTION,
+                   {"find": CALORIE_DAILY_COLLECTION, "filter": {"email_id": email, "date": week_ago},
+                    "projection": {"_id": 0, "total_calories": 1}, "limit": 1, "singleBatch": True}),
+        QueryShape(f"{CALORIE_DAILY_COLLECTION}.find_one_by_email",
+                   "retention.has_daily_totals (calorie.get_total_calorie_by_date)", CALORIE_DAILY_COLLECTION,
+                   {"find": CALORIE_DAILY_COLLECTION, "filter": {"email_id": email}, "projection": {"_id": 1},
+                    "limit": 1, "singleBatch": True}),
+        QueryShape("calorie_data.rollup_claim", "retention.rollup_calories", "calorie_data",
+                   {"aggregate": "calorie_data", "pipeline": rollup_claim_pipeline(today, RETENTION_BATCH_SIZE),
+                    "cursor": {}}),
+        QueryShape("calorie_data.weekly_aggregate", "calorie.get_weekly_calorie", "calorie_data",
+                   {"aggregate": "calorie_data", "pipeline": weekly_calorie_pipeline(email, week_ago, today),
+                    "cursor": {}}),
+        QueryShape("calorie_data.dashboard_aggregate", "dashboard.get_dashboard", "calorie_data",
+                   {"aggregate": "calorie_data", "pipeline": calorie_summary_pipeline(email, today, week_ago),
+                    "cursor": {}}),
+    ]
+    shapes += [
+        QueryShape(f"{name}.distinct_email", source, name, {"distinct": name, "key": "email_id", "query": {}})
+        for name, source in (("nutrition_app_user", "mongo_crud_data.get_user_data_from_mongo"),
+                             ("chat_data", "mongo_crud_data.get_all_chats"),
+                             ("calorie_data", "calorie.get_individual_calorie_by_date"))
+    ]
+    return shapes
+
+
+def seed(db, users: int, days: int, entries_per_day: int, today: date) -> str:
+    """
+    Fills db with synthetic users shaped like the documents the routers write
+    Days before today are in the state the retention job leaves them: rolled up into calorie_daily and stamped.
+    :return: email of a seeded user to run the query shapes with
+    """
+    from settings.retention import CALORIE_DAILY_COLLECTION
+
+    rng = random.Random(42)
+    rolled_up_at = datetime.now(timezone.utc)
+    profiles, meals, groceries, recommendations, chats, calories, daily = [], [], [], [], [], [], []
+    for index in range(users):
+        email = f"audit{index}@example.com"
+        profiles.append({"email_id": email, "data": json.dumps(USER_PROFILE), "etag": f"{index:032x}"})
+        meals.append({"email_id": email, "meal": {"day_1": {"breakfast": "oats"}}, "etag": f"{index:032x}"})
+        groceries.append({"email_id": email, "grocery_list": {"oats": "1kg"}, "etag": f"{index:032x}"})
+        recommendations.append({"email_id": email, "recommendation": "{}", "etag": f"{index:032x}"})
+        chats.append({"email_id": email, "history": []})
+        for day in range(days):
+            entries = [{"email_id": email, "calorie": rng.randint(50, 900), "food_item": "item",
+                        "date": str(today - timedelta(days=day))} for _ in range(entries_per_day)]
+            if day > 0:
+                for entry in entries:
+                    entry["rolled_up_at"] = rolled_up_at
+                daily.append({"email_id": email, "date": str(today - timedelta(days=day)), "entries": len(entries),
+                              "total_calories": sum(entry["calorie"] for entry in entries)})
+            calories += entries
+
+    for name, documents in (("nutrition_app_user", profiles), ("meal_data", meals), ("grocery_data", groceries),
+                            ("nutrition_recommendation_data", recommendations), ("chat_data", chats),
+                            ("calorie_data", calories), (CALORIE_DAILY_COLLECTION, daily)):
+        for start in range(0, len(documents), 5000):
+            db[name].insert_many(documents[start:start + 5000], ordered=False)
+    return "audit0@example.com"
+
+
+def is_scratch(client, name: str) -> bool:
+    """
+    True when the database does not exist yet or was created by a previous audit run
+    """
+    return name not in client.list_database_names() or SCRATCH_MARKER in client[name].list_collection_names()
+
+
+def ensure_app_indexes() -> None:
+    """
+    Creates exactly the indexes the FastAPI lifespan creates, through the routers' own ensure_indexes
+    """
+    from routers import calorie, mongo_crud_data
+    from settings import resources, retention
+    try:
+        mongo_crud_data.ensure_indexes()
+        calorie.ensure_indexes()
+        retention.ensure_indexes()
+    finally:
+        resources.close_all()
+
+
+def _find_all(document, key: str):
+    """
+    Yields every value stored under key anywhere in a nested explain document
+    """
+    if isinstance(document, dict):
+        for name, value in document.items():
+            if name == key:
+                yield value
+            yield from _find_all(value, key)
+    elif isinstance(document, list):
+        for value in document:
+            yield from _find_all(value, key)
+
+
+def _filter_of(shape: QueryShape) -> dict:
+    command = shape.command
+    if "filter" in command:
+        return command["filter"]
+    if "pipeline" in command:
+        return command["pipeline"][0].get("$match", {})
+    if "distinct" in command:
+        return dict(command["query"], **{command["key"]: None})
+    statements = command.get("updates") or command.get("deletes")
+    return statements[0]["q"]
+
+
+def suggested_index(shape: QueryShape) -> list:
+    """
+    Index serving the shape's filter: equality fields first, then range fields
+    """
+    equality, ranges = [], []
+    for field, condition in _filter_of(shape).items():
+        is_range = isinstance(condition, dict) and any(op != "$eq" for op in condition)
+        (ranges if is_range else equality).append(field)
+    return equality + ranges
+
+
+def has_index(db, collection: str, fields: list) -> bool:
+    for index in db[collection].index_information().values():
+        if [field for field, _ in index["key"]][:len(fields)] == fields:
+            return True
+    return False
+
+
+def explain_shape(db, shape: QueryShape, max_ratio: float) -> dict:
+    explain = db.command("explain", shape.command, verbosity="executionStats")
+    stages = sorted(set(_find_all(list(_find_all(explain, "winningPlan")), "stage")))
+    docs_examined = sum(stats.get("totalDocsExamined", 0) for stats in _find_all(explain, "executionStats"))
+    keys_examined = sum(stats.get("totalKeysExamined", 0) for stats in _find_all(explain, "executionStats"))
+    returned = sum(stats.get("nReturned", 0) for stats in _find_all(explain, "executionStats"))
+    ratio = docs_examined / max(returned, 1)
+    index_fields = suggested_index(shape)
+
+    problems = []
+    if "COLLSCAN" in stages:
+        problems.append("collscan")
+    if ratio > max_ratio:
+        problems.append("ratio")
+    if index_fields and not has_index(db, shape.collection, index_fields):
+        problems.append("missing_index")
+    return {
+        "shape": shape.name,
+        "source": shape.source,
+        "collection": shape.collection,
+        "stages": stages,
+        "docs_examined": docs_examined,
+        "keys_examined": keys_examined,
+        "returned": returned,
+        "docs_examined_per_returned": round(ratio, 2),
+        "suggested_index": index_fields,
+        "problems": problems,
+    }
+
+
+def audit(db, shapes: list, max_ratio: float = 10.0) -> list:
+    return [explain_shape(db, shape, max_ratio) for shape in shapes]
+
+
+def regressions(results: list, baseline: dict = None) -> list:
+    """
+    Problems not accepted by the baseline, a mapping of shape name to accepted problem kinds
+    :return: list of (shape name, problem kind)
+    """
+    baseline = baseline or {}
+    return [(result["shape"], problem) for result in results for problem in result["problems"]
+            if problem not in baseline.get(result["shape"], [])]
+
+
+def assert_query_plans(db, email: str, max_ratio: float = 10.0, baseline: dict = None) -> list:
+    """
+    Test helper: audits every query shape against db and raises AssertionError listing the regressions
+    """
+    today = date.today()
+    results = audit(db, query_shapes(email, str(today), str(today - timedelta(days=7))), max_ratio)
+    found = regressions(results, baseline)
+    assert not found, "Query plan regressions: " + ", ".join(f"{shape} ({problem})" for shape, problem in found)
+    return results
+
+
+def print_report(results: list, found: list) -> None:
+    regressed = {shape for shape, _ in found}
+    for result in results:
+        marker = "FAIL" if result["shape"] in regressed else ("warn" if result["problems"] else "ok")
+        print(f"{marker:<5}{result['shape']:<48}{'+'.join(result['stages']):<40}"
+              f"examined {result['docs_examined']:>7d} / returned {result['returned']:>5d} "
+              f"({result['docs_examined_per_returned']:>8.2f})  {','.join(result['problems'])}")
+        if "missing_index" in result["problems"]:
+            print(f"{'':<5}  suggested index on {result['collection']}: "
+                  f"{{{', '.join(f'{field}: 1' for field in result['suggested_index'])}}}  ({result['source']})")
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mongo-uri", default="mongodb://localhost:27017")
+    parser.add_argument("--database", default="nutrition_ai_query_audit")
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--days", type=int, default=30)
+    parser.add_argument("--entries-per-day", type=int, default=3)
+    parser.add_argument("--no-seed", action="store_true", help="Audit the database as it is")
+    parser.add_argument("--max-ratio", type=float, default=10.0, help="Allowed docs examined per doc returned")
+    parser.add_argument("--baseline",
+                        help="JSON mapping shape name to accepted problem kinds (collscan, ratio, missing_index)")
+    parser.add_argument("--write-baseline", help="Accept every current problem and write them here")
+    parser.add_argument("--output", help="Write the JSON report here")
+    args = parser.parse_args(argv)
+
+    client = pymongo.MongoClient(args.mongo_uri, serverSelectionTimeoutMS=5000)
+    db = client[args.database]
+    # The routers resolve their collections through settings.resources, point them at the audit database
+    os.environ.update(MONGO_URI=args.mongo_uri, MONGO_DATABASE=args.database, MONGO_TLS="false")
+    for name in ("OPENAI_API_KEY", "AZURE_STORAGE_CONN_STRING", "AZURE_STORAGE_KEY"):
+        os.environ.setdefault(name, "unused")
+
+    today = date.today()
+    created = False
+    try:
+        if args.no_seed:
+            sample = db["nutrition_app_user"].find_one({}, {"_id": 0, "email_id": 1}) or {}
+            email = sample.get("email_id", "nobody@example.com")
+        else:
+            if not is_scratch(client, args.database):
+                print(f"Refusing to seed and drop {args.database}: it exists and was not created by the audit, "
+                      f"use --no-seed to audit it as it is", file=sys.stderr)
+                return 2
+            # Left over from an interrupted run
+            client.drop_database(args.database)
+            db[SCRATCH_MARKER].insert_one({"created_by": "benchmarks.query_audit"})
+            created = True
+            email = seed(db, args.users, args.days, args.entries_per_day, today)
+            ensure_app_indexes()
+        results = audit(db, query_shapes(email, str(today), str(today - timedelta(days=7))), args.max_ratio)
+    except PyMongoError as e:
+        print(f"Query plan audit failed against {args.mongo_uri}: {e}", file=sys.stderr)
+        return 2
+    finally:
+        if created:
+            try:
+                client.drop_database(args.database)
+            except PyMongoError:
+                pass
+        client.close()
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    found = regressions(results, baseline)
+    print_report(results, found)
+
+    if args.write_baseline:
+        with open(args.write_baseline, "w") as f:
+            json.dump({result["shape"]: result["problems"] for result in results if result["problems"]}, f,
+                      indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"max_ratio": args.max_ratio, "results": results, "regressions": found}, f, indent=2)
+
+    if found and not args.write_baseline:
+        print(f"{len(found)} query plan regression(s)", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,258 @@
+"""
+Offline load benchmark for the Nutrition AI backend.
+
+Boots the FastAPI app in-process against mongomock (or a local mongod via --mongo-uri), the fake OpenAI server
+and the fake Azure Blob endpoint from benchmarks.fakes, then drives every router with concurrent scenarios and
+writes a JSON report that can be compared across commits.
+
+    pip install -r requirements.txt -r benchmarks/requirements.txt
+    python -m benchmarks.run --output bench_output.json
+    python -m benchmarks.run --compare bench_output.json --output new.json
+"""
+import argparse
+import asyncio
+import io
+import json
+import logging
+import os
+import platform
+import statistics
+import struct
+import subprocess
+import sys
+import time
+import zlib
+from datetime import datetime, timezone
+
+import httpx
+
+from benchmarks.fakes import BackgroundServer, fake_blob_app, fake_openai_app
+
+logging.basicConfig(level=logging.WARNING)
+logger = logging.getLogger(__name__)
+
+USER_PROFILE = {
+    "name": "Bench User", "age": 29, "gender": "female", "height": 5.6, "weight": 140,
+    "activity_level": "moderate", "exercise_hours": 4, "job_type": "working", "work_type": "office",
+    "work_hours": 40, "cooking_hours": 6, "proficiency_in_cooking": "medium", "goals": "healthy",
+    "dietary_restrictions": None, "diet_type": "balanced", "allergies": None, "cuisine_preference": "indian",
+    "budget": 80, "grocery_frequency": "weekly", "calorie_goal": 1900,
+}
+
+
+def _tiny_png() -> bytes:
+    """A valid 1x1 PNG built with the stdlib so the image scenario does not depend on Pillow"""
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+    header = struct.pack(">IIBBBBB", 1, 1, 8, 2, 0, 0, 0)
+    return (b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header)
+            + chunk(b"IDAT", zlib.compress(b"\x00\xff\x99\x33")) + chunk(b"IEND", b""))
+
+
+def _email(index: int) -> str:
+    return f"bench{index}@example.com"
+
+
+def _scenarios(users: int, today: str) -> dict:
+    """
+    Each scenario maps a name to a coroutine factory issuing exactly one request for iteration i
+    """
+    image = _tiny_png()
+
+    def user(i):
+        return _email(i % users)
+
+    return {
+        "mongo_read_user": lambda c, i: c.get(f"/mongo/read_user_info_from_mongo/{user(i)}",
+                                              params={"email_id": user(i)}),
+        "mongo_write_user": lambda c, i: c.post("/mongo/write_user_info_to_mongo", headers={"email-id": user(i)},
+                                                data={"data": json.dumps(USER_PROFILE)}),
+        "calorie_write": lambda c, i: c.post("/calorie/write_calorie_to_mongo", headers={"email-id": user(i)},
+                                             data={"calorie": "420", "food_item": "dal makhani"}),
+        "calorie_total": lambda c, i: c.get(f"/calorie/get_total_calorie_by_date/{user(i)}/{today}"),
+        "calorie_weekly": lambda c, i: c.get(f"/calorie/get_weekly_calorie/{user(i)}"),
+        "dashboard": lambda c, i: c.get(f"/dashboard/{user(i)}"),
+        "meal_show": lambda c, i: c.get(f"/meal/show_meal/{user(i)}", params={"email_id": user(i)}),
+        "meal_generate": lambda c, i: c.get(f"/meal/generate_meal/{user(i)}", params={"email_id": user(i)}),
+        "grocery_show": lambda c, i: c.get(f"/grocery/show_grocery_list/{user(i)}", params={"email_id": user(i)}),
+        "grocery_generate": lambda c, i: c.get(f"/grocery/generate_grocery_list/{user(i)}",
+                                               params={"email_id": user(i)}),
+        "recommend_generate": lambda c, i: c.get(f"/recommend/generate_recommendation/{user(i)}",
+                                                 params={"email_id": user(i)}),
+        "chat": lambda c, i: c.post("/health/chat", headers={"email-id": user(i)}, params={"email_id": user(i)},
+                                    data={"message": "how long does the dinner take to cook?",
+                                          "history": ["[]"]}),
+        "ai_image_calorie": lambda c, i: c.post("/ai_image/get_calorie_value", headers={"email-id": user(i)},
+                                                files={"image_file": ("plate.png", io.BytesIO(image),
+                                                                      "image/png")}),
+        "ai_image_batch": lambda c, i: c.post("/ai_image/get_calorie_values", headers={"email-id": user(i)},
+                                              files=[("image_files", (f"plate{n}.png", io.BytesIO(image),
+                                                                      "image/png")) for n in range(4)]),
+    }
+
+
+async def _seed(client: httpx.AsyncClient, users: int) -> None:
+    for i in range(users):
+        email = _email(i)
+        await client.post("/mongo/write_user_info_to_mongo", headers={"email-id": email},
+                          data={"data": json.dumps(USER_PROFILE)})
+        for food, calorie in (("poha", 300), ("rajma chawal", 650), ("fruit bowl", 180)):
+            await client.post("/calorie/write_calorie_to_mongo", headers={"email-id": email},
+                              data={"calorie": str(calorie), "food_item": food})
+        await client.get(f"/meal/generate_meal/{email}", params={"email_id": email})
+        await client.get(f"/grocery/generate_grocery_list/{email}", params={"email_id": email})
+        await client.get(f"/recommend/generate_recommendation/{email}", params={"email_id": email})
+
+
+def _percentile(samples: list, fraction: float) -> float:
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, int(round(fraction * len(ordered))) - 1))
+    return ordered[index]
+
+
+async def _run_scenario(client: httpx.AsyncClient, make_request, requests: int, concurrency: int) -> dict:
+    latencies = []
+    errors = 0
+    counter = iter(range(requests))
+
+    async def worker():
+        nonlocal errors
+        for i in counter:
+            start = time.perf_counter()
+            try:
+                response = await make_request(client, i)
+                if response.status_code >= 400:
+                    errors += 1
+            except Exception as e:
+                logger.warning(f"Request failed: {str(e)}")
+                errors += 1
+            latencies.append(time.perf_counter() - start)
+
+    wall_start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    wall = time.perf_counter() - wall_start
+    return {
+        "requests": requests,
+        "concurrency": concurrency,
+        "errors": errors,
+        "throughput_rps": round(requests / wall, 2),
+        "mean_ms": round(statistics.mean(latencies) * 1000, 2),
+        "p50_ms": round(_percentile(latencies, 0.50) * 1000, 2),
+        "p95_ms": round(_percentile(latencies, 0.95) * 1000, 2),
+        "p99_ms": round(_percentile(latencies, 0.99) * 1000, 2),
+        "max_ms": round(max(latencies) * 1000, 2),
+    }
+
+
+def _git_revision() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True).strip()
+    except Exception:
+        return "unknown"
+
+
+def configure_environment(mongo_uri: str, openai_url: str, blob_url: str) -> None:
+    """
+    Points the app at the local stand-ins. Must run before main is imported.
+    """
+    os.environ["MONGO_URI"] = mongo_uri
+    os.environ["MONGO_TLS"] = "false"
+    os.environ["OPENAI_API_KEY"] = "sk-benchmark"
+    os.environ["OPENAI_BASE_URL"] = f"{openai_url}/v1"
+    os.environ["AZURE_STORAGE_ACCOUNT_URL"] = f"{blob_url}/devstoreaccount1"
+    os.environ["AZURE_STORAGE_CONN_STRING"] = "UseDevelopmentStorage=true"
+    os.environ["AZURE_STORAGE_KEY"] = "YmVuY2htYXJr"
+    # Measure the app, not the per-user limiter; export lower values to benchmark admission control itself
+    os.environ.setdefault("RATE_LIMIT_BURST", "1000000")
+    os.environ.setdefault("RATE_LIMIT_PER_MINUTE", "1000000")
+
+
+async def run(args) -> dict:
+    from main import app
+
+    transport = httpx.ASGITransport(app=app)
+    results = {}
+    async with app.router.lifespan_context(app):
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=120) as client:
+            await _seed(client, args.users)
+            scenarios = _scenarios(args.users, str(datetime.now().date()))
+            selected = args.scenarios or list(scenarios)
+            for name in selected:
+                results[name] = await _run_scenario(client, scenarios[name], args.requests, args.concurrency)
+                print(f"{name:22s} {results[name]['throughput_rps']:>9.2f} rps  "
+                      f"p50 {results[name]['p50_ms']:>8.2f} ms  p99 {results[name]['p99_ms']:>8.2f} ms  "
+                      f"errors {results[name]['errors']}")
+    return {
+        "revision": _git_revision(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "settings": {"users": args.users, "requests": args.requests, "concurrency": args.concurrency,
+                     "openai_latency": args.openai_latency, "blob_latency": args.blob_latency,
+                     "mongo_uri": args.mongo_uri},
+        "scenarios": results,
+    }
+
+
+def compare(previous: dict, current: dict, threshold: float) -> bool:
+    """
+    Prints per-scenario deltas and returns False when any p95 regressed by more than threshold
+    """
+    ok = True
+    print(f"\nComparison against {previous.get('revision')}:")
+    for name, result in current["scenarios"].items():
+        before = previous.get("scenarios", {}).get(name)
+        if before is None:
+            continue
+        delta = (result["p95_ms"] - before["p95_ms"]) / before["p95_ms"] if before["p95_ms"] else 0.0
+        rps_delta = (result["throughput_rps"] - before["throughput_rps"]) / before["throughput_rps"]
+        flag = ""
+        if delta > threshold:
+            flag = "  REGRESSION"
+            ok = False
+        print(f"{name:22s} p95 {before['p95_ms']:>8.2f} -> {result['p95_ms']:>8.2f} ms ({delta:+.1%})  "
+              f"rps {rps_delta:+.1%}{flag}")
+    return ok
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mongo-uri", default="mongomock://localhost",
+                        help="mongomock://localhost or a local mongodb:// URI")
+    parser.add_argument("--openai-latency", type=float, default=0.2, help="Seconds per fake completion")
+    parser.add_argument("--openai-token-latency", type=float, default=0.0, help="Seconds between streamed chunks")
+    parser.add_argument("--blob-latency", type=float, default=0.02, help="Seconds per fake blob call")
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--requests", type=int, default=200, help="Requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--scenarios", nargs="*", help="Subset of scenarios to run")
+    parser.add_argument("--openai-port", type=int, default=18080)
+    parser.add_argument("--blob-port", type=int, default=18081)
+    parser.add_argument("--output", help="Write the JSON report here")
+    parser.add_argument("--compare", help="Previous JSON report to compare against")
+    parser.add_argument("--threshold", type=float, default=0.10, help="Allowed relative p95 regression")
+    args = parser.parse_args(argv)
+
+    openai_server = BackgroundServer(fake_openai_app(args.openai_latency, args.openai_token_latency),
+                                     args.openai_port).start()
+    blob_server = BackgroundServer(fake_blob_app(args.blob_latency), args.blob_port).start()
+    configure_environment(args.mongo_uri, openai_server.url, blob_server.url)
+    try:
+        report = asyncio.run(run(args))
+    finally:
+        openai_server.stop()
+        blob_server.stop()
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)
+        if not compare(previous, report, args.threshold):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
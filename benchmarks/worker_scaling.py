@@ -0,0 +1,128 @@
+"""
+Throughput scaling with the number of gunicorn workers.
+
+Starts the app with gunicorn.conf.py for each worker count against the local stand-ins and hammers a mix of
+read/write routes over real HTTP for a fixed duration.
+
+    python -m benchmarks.worker_scaling --workers 1 2 4 8 --mongo-uri mongodb://localhost:27017
+
+mongomock keeps one in-memory database per worker process, so use a local mongod for representative numbers.
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+import httpx
+
+from benchmarks.cold_start import REPO_ROOT
+from benchmarks.fakes import BackgroundServer, fake_blob_app, fake_openai_app
+from benchmarks.run import _git_revision, _percentile, configure_environment
+
+ROUTES = [
+    "/calorie/get_weekly_calorie/{email}",
+    "/calorie/get_total_calorie_by_date/{email}/2024-01-01",
+    "/meal/show_meal/{email}?email_id={email}",
+    "/mongo/read_user_info_from_mongo/{email}?email_id={email}",
+]
+
+
+def wait_until_ready(url: str, timeout: float = 60.0) -> None:
+    start = time.perf_counter()
+    while time.perf_counter() - start < timeout:
+        try:
+            if httpx.get(f"{url}/metrics", timeout=2).status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        time.sleep(0.05)
+    raise TimeoutError(f"Server at {url} did not come up within {timeout}s")
+
+
+async def drive(url: str, duration: float, connections: int) -> dict:
+    latencies = []
+    errors = 0
+    deadline = time.perf_counter() + duration
+    limits = httpx.Limits(max_connections=connections, max_keepalive_connections=connections)
+
+    async with httpx.AsyncClient(base_url=url, limits=limits, timeout=30) as client:
+        async def worker(worker_id: int):
+            nonlocal errors
+            request_id = 0
+            while time.perf_counter() < deadline:
+                email = f"scale{worker_id}@example.com"
+                route = ROUTES[request_id % len(ROUTES)].format(email=email)
+                request_id += 1
+                start = time.perf_counter()
+                try:
+                    response = await client.get(route)
+                    if response.status_code >= 500:
+                        errors += 1
+                except httpx.HTTPError:
+                    errors += 1
+                latencies.append(time.perf_counter() - start)
+
+        wall_start = time.perf_counter()
+        await asyncio.gather(*(worker(index) for index in range(connections)))
+        wall = time.perf_counter() - wall_start
+
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "throughput_rps": round(len(latencies) / wall, 1),
+        "p50_ms": round(_percentile(latencies, 0.50) * 1000, 2),
+        "p99_ms": round(_percentile(latencies, 0.99) * 1000, 2),
+        "mean_ms": round(statistics.mean(latencies) * 1000, 2),
+    }
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--duration", type=float, default=15.0, help="Seconds of load per worker count")
+    parser.add_argument("--connections", type=int, default=64)
+    parser.add_argument("--mongo-uri", default="mongomock://localhost")
+    parser.add_argument("--port", type=int, default=18100)
+    parser.add_argument("--openai-port", type=int, default=18084)
+    parser.add_argument("--blob-port", type=int, default=18085)
+    parser.add_argument("--output", help="Write the JSON report here")
+    args = parser.parse_args(argv)
+
+    openai_server = BackgroundServer(fake_openai_app(), args.openai_port).start()
+    blob_server = BackgroundServer(fake_blob_app(), args.blob_port).start()
+    configure_environment(args.mongo_uri, openai_server.url, blob_server.url)
+    url = f"http://127.0.0.1:{args.port}"
+    results = {}
+    try:
+        for workers in args.workers:
+            env = dict(os.environ, WEB_CONCURRENCY=str(workers), GUNICORN_BIND=f"127.0.0.1:{args.port}",
+                       GUNICORN_ACCESS_LOG="")
+            server = subprocess.Popen([sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "main:app"],
+                                      cwd=REPO_ROOT, env=env)
+            try:
+                wait_until_ready(url)
+                results[workers] = asyncio.run(drive(url, args.duration, args.connections))
+            finally:
+                server.terminate()
+                server.wait(timeout=60)
+            baseline = results[args.workers[0]]["throughput_rps"]
+            result = results[workers]
+            print(f"workers={workers:<3d} {result['throughput_rps']:>9.1f} rps "
+                  f"(x{result['throughput_rps'] / baseline:.2f})  p50 {result['p50_ms']:>7.2f} ms  "
+                  f"p99 {result['p99_ms']:>7.2f} ms  errors {result['errors']}")
+    finally:
+        openai_server.stop()
+        blob_server.stop()
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"revision": _git_revision(), "cores": os.cpu_count(), "results": results}, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,57 @@
+"""
+Production server settings, picked up automatically by `gunicorn main:app` from the working directory.
+
+Every value can be overridden through the environment, e.g. WEB_CONCURRENCY=8 gunicorn main:app
+"""
+import logging
+import multiprocessing
+import os
+import shutil
+import tempfile
+
+logger = logging.getLogger("gunicorn.error")
+
+cores = multiprocessing.cpu_count()
+
+bind = os.environ.get("GUNICORN_BIND", f"0.0.0.0:{os.environ.get('PORT', '8000')}")
+worker_class = "uvicorn.workers.UvicornWorker"
+# Requests spend most of their time waiting on Mongo/OpenAI, so run more workers than cores
+workers = int(os.environ.get("WEB_CONCURRENCY", str(cores * 2 + 1)))
+
+# Import the app once in the master so workers fork from a warm interpreter. Safe because no client is created
+# at import time and settings.resources drops anything inherited across fork; each worker connects in its lifespan.
+preload_app = os.environ.get("GUNICORN_PRELOAD", "true").lower() == "true"
+
+# LLM generations can take well over the 30s default
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", "180"))
+graceful_timeout = int(os.environ.get("GUNICORN_GRACEFUL_TIMEOUT", "30"))
+# Must exceed the idle timeout of the load balancer in front of us, or it will reuse connections we closed
+keepalive = int(os.environ.get("GUNICORN_KEEPALIVE", "75"))
+# Recycle workers periodically (staggered by the jitter) to bound memory growth
+max_requests = int(os.environ.get("GUNICORN_MAX_REQUESTS", "5000"))
+max_requests_jitter = int(os.environ.get("GUNICORN_MAX_REQUESTS_JITTER", "500"))
+
+accesslog = os.environ.get("GUNICORN_ACCESS_LOG", "-") or None
+forwarded_allow_ips = os.environ.get("FORWARDED_ALLOW_IPS", "*")
+
+# Parallelism comes from the workers, keep each worker's image pool small
+os.environ.setdefault("IMAGE_WORKERS", "1")
+
+# Workers share metrics through files; must be set before prometheus_client is imported by the app
+os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", os.path.join(tempfile.gettempdir(), "nutrition_ai_metrics"))
+
+
+def on_starting(server):
+    metrics_dir = os.environ["PROMETHEUS_MULTIPROC_DIR"]
+    shutil.rmtree(metrics_dir, ignore_errors=True)
+    os.makedirs(metrics_dir, exist_ok=True)
+    logger.info(f"Starting {workers} workers on {bind} (preload={preload_app})")
+
+
+def post_fork(server, worker):
+    logger.info(f"Worker spawned (pid: {worker.pid})")
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
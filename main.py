@@ -1,21 +1,46 @@
 import logging
 import os
+from contextlib import asynccontextmanager
 
 import uvicorn
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from starlette.concurrency import run_in_threadpool
 
-from routers import ai_image, mongo_crud_data, ai_gpt, grocery, meal, recommend, calorie
+from settings import images, profiling, prompts, purge, ratelimit, resources, retention
+from settings.encoding import ContentEncodingMiddleware
+from settings.metrics import MetricsMiddleware, metrics_endpoint
+from routers import ai_image, mongo_crud_data, ai_gpt, grocery, meal, recommend, calorie, dashboard
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Clients and prompt chains are created here rather than at import time so that importing main stays cheap
+    # and every worker process opens its own connections.
+    await run_in_threadpool(resources.open_all)
+    await run_in_threadpool(prompts.compile_all)
+    await run_in_threadpool(mongo_crud_data.ensure_indexes)
+    await run_in_threadpool(calorie.ensure_indexes)
+    await run_in_threadpool(ratelimit.ensure_indexes)
+    await run_in_threadpool(retention.ensure_indexes)
+    logger.info("Clients connected, prompt chains compiled and indexes ensured")
+    yield
+    await ai_image.drain_background_uploads()
+    await purge.drain_background_deletions()
+    resources.close_all()
+    images.shutdown_executor()
+
+
 app = FastAPI(
     title="Nutrition AI",
     description="APIs for Nutrition AI",
     version="2.0.0",
     openapi_url="/openapi.json",
-    docs_url="/"
+    docs_url="/",
+    lifespan=lifespan
 )
 
 app.add_middleware(
@@ -25,6 +50,11 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(ContentEncodingMiddleware)
+if profiling.is_configured():
+    app.add_middleware(profiling.ProfilingMiddleware)
+app.add_middleware(MetricsMiddleware)
+app.add_route("/metrics", metrics_endpoint, include_in_schema=False)
 
 #Routers
 app.include_router(ai_image.router, prefix="/ai_image", tags=["ai_image"])
@@ -34,7 +64,13 @@ app.include_router(grocery.router, prefix="/grocery", tags=["grocery"])
 app.include_router(meal.router, prefix="/meal", tags=["meal"])
 app.include_router(recommend.router, prefix="/recommend", tags=["recommend"])
 app.include_router(calorie.router, prefix="/calorie", tags=["calorie"])
+app.include_router(dashboard.router, prefix="/dashboard", tags=["dashboard"])
 
-#
-# if __name__ == "__main__":
-#     uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
\ No newline at end of file
+# Production runs through gunicorn (see gunicorn.conf.py); this entry point is for local runs and containers
+# without gunicorn, e.g. WEB_CONCURRENCY=4 python main.py
+if __name__ == "__main__":
+    uvicorn.run("main:app", host="0.0.0.0", port=int(os.environ.get("PORT", "8000")),
+                workers=int(os.environ.get("WEB_CONCURRENCY", "1")),
+                timeout_keep_alive=int(os.environ.get("GUNICORN_KEEPALIVE", "75")),
+                timeout_graceful_shutdown=int(os.environ.get("GUNICORN_GRACEFUL_TIMEOUT", "30")),
+                proxy_headers=True, forwarded_allow_ips="*")
@@ -1,25 +1,189 @@
+import asyncio
+import base64
 import logging
 import os
+import re
+import time
 import uuid
-from fastapi import APIRouter, Form, HTTPException, Header, UploadFile, status
+from datetime import datetime
+from fastapi import APIRouter, Depends, File, Form, HTTPException, Header, Request, UploadFile, status
 from fastapi.responses import JSONResponse
-from typing import Optional, Annotated, Union
-from azure.storage.blob import BlobServiceClient, BlobClient, ContainerClient, PublicAccess
-from settings.config import Config
-from settings.utils import get_username_from_email
+from starlette.concurrency import run_in_threadpool
+from typing import List, Optional, Annotated, Union
+from routers.calorie import collection as calorie_collection
+from settings.images import ProcessedImage, process_image
+from settings.metrics import record_openai_response
+from settings.ratelimit import admission, charge, limiter, llm_rate_limit
+from settings.resources import get_azure_storage_client, get_vision_llm
+from settings.utils import get_container_name_from_email, get_username_from_email
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 router = APIRouter()
-Config = Config()
-vision_llm = Config.get_openai_vision_connection()
 
-# Get the Azure Storage client from configuration
-azure_storage_client = Config.get_azure_storage_client()
+# Send the image bytes inline to the vision model so inference does not wait for the blob upload
+VISION_INLINE_IMAGES = os.environ.get("VISION_INLINE_IMAGES", "true").lower() == "true"
+UPLOAD_RETRIES = int(os.environ.get("UPLOAD_RETRIES", "3"))
+UPLOAD_RETRY_BACKOFF = float(os.environ.get("UPLOAD_RETRY_BACKOFF", "0.5"))
+# Upper bounds for /get_calorie_values: images per request and images analysed at the same time
+BATCH_MAX_IMAGES = int(os.environ.get("BATCH_MAX_IMAGES", "10"))
+BATCH_CONCURRENCY = int(os.environ.get("BATCH_CONCURRENCY", "4"))
+ALLOWED_CONTENT_TYPES = ["image/jpeg", "image/jpg", "image/png"]
+
+CALORIE_PROMPT = ("Guess the Calorie value of this food item from this image. Just give the number of calories, "
+                  "and no other chracter like around or about etc, ")
+NAME_PROMPT = "Guess the Food Item in this image. Just give the name of the dish "
+
+# Strong references to in-flight background uploads, asyncio only keeps weak ones
+_background_uploads = set()
+
+
+def _data_url(processed: ProcessedImage) -> str:
+    return f"data:{processed.content_type};base64,{base64.b64encode(processed.data).decode('ascii')}"
+
+
+def _upload_image(container_name: str, image_name: str, thumbnail_name: str, processed: ProcessedImage) -> str:
+    """
+    Creates the user's container if needed and uploads the image and its thumbnail
+    :return: URL of the uploaded image
+    """
+    from azure.storage.blob import ContentSettings, PublicAccess
+    azure_storage_client = get_azure_storage_client()
+    container_client = azure_storage_client.get_container_client(container_name)
+
+    # Check if container exists, if not create it
+    try:
+        container_client.create_container(public_access=PublicAccess.Container)
+        logger.info(f"Created container for user: {container_name}")
+    except Exception as e:
+        logger.info(f"Container for user {container_name} already exists or another issue occurred: {str(e)}")
+
+    content_settings = ContentSettings(content_type=processed.content_type)
+    blob_client = azure_storage_client.get_blob_client(container=container_name, blob=image_name)
+    blob_client.upload_blob(processed.data, content_settings=content_settings, overwrite=True)
+    azure_storage_client.get_blob_client(container=container_name, blob=thumbnail_name).upload_blob(
+        processed.thumbnail, content_settings=content_settings, overwrite=True)
+    logger.info(f"File uploaded to Azure Blob Storage: {blob_client.url}")
+    return blob_client.url
+
+
+async def _persist_image(container_name: str, image_name: str, thumbnail_name: str,
+                         processed: ProcessedImage) -> str:
+    """
+    Uploads with exponential backoff, re-raising the last error once UPLOAD_RETRIES attempts have failed
+    """
+    for attempt in range(1, UPLOAD_RETRIES + 1):
+        try:
+            return await run_in_threadpool(_upload_image, container_name, image_name, thumbnail_name, processed)
+        except Exception as e:
+            if attempt == UPLOAD_RETRIES:
+                logger.error(f"Giving up uploading {container_name}/{image_name} after {attempt} attempts: {str(e)}")
+                raise
+            logger.warning(f"Upload of {container_name}/{image_name} failed (attempt {attempt}): {str(e)}")
+            await asyncio.sleep(UPLOAD_RETRY_BACKOFF * 2 ** (attempt - 1))
+
+
+def _persist_in_background(container_name: str, image_name: str, thumbnail_name: str,
+                           processed: ProcessedImage) -> None:
+    task = asyncio.create_task(_persist_image(container_name, image_name, thumbnail_name, processed))
+    _background_uploads.add(task)
+    task.add_done_callback(_background_uploads.discard)
+    # Failures are already logged by _persist_image, retrieve them so asyncio does not warn
+    task.add_done_callback(lambda done: done.cancelled() or done.exception())
+
+
+async def drain_background_uploads(timeout: float = 30.0) -> None:
+    """
+    Waits for pending background uploads, called from the lifespan on shutdown
+    """
+    if _background_uploads:
+        logger.info(f"Waiting for {len(_background_uploads)} background uploads")
+        await asyncio.wait(set(_background_uploads), timeout=timeout)
+
+
+def _ask_vision(prompt: str, image_url: str, detail: str) -> str:
+    start = time.perf_counter()
+    response = get_vision_llm().chat.completions.create(
+        model="gpt-4o-mini",
+        messages=[
+            {
+                "role": "user",
+                "content": [
+                    {"type": "text", "text": prompt},
+                    {"type": "image_url", "image_url": {"url": image_url, "detail": detail}},
+                ],
+            }
+        ],
+        max_tokens=300,
+    )
+    record_openai_response(response, time.perf_counter() - start)
+    return response.choices[0].message.content
+
+
+async def _ask_vision_admitted(prompt: str, image_url: str, detail: str) -> str:
+    """
+    Every vision call takes its own admission slot, so batches cannot exceed the global LLM in-flight cap
+    """
+    async with admission.slot():
+        return await run_in_threadpool(_ask_vision, prompt, image_url, detail)
+
+
+async def _analyze_image(image_url: str, detail: str) -> tuple:
+    """
+    Asks for the calorie value and the dish name concurrently
+    :return: (name, calorie_value)
+    """
+    calorie_value, name = await asyncio.gather(_ask_vision_admitted(CALORIE_PROMPT, image_url, detail),
+                                               _ask_vision_admitted(NAME_PROMPT, image_url, detail))
+    return name, calorie_value
+
+
+async def _analyze_upload(container_name: str, raw: bytes) -> tuple:
+    """
+    Pre-processes one uploaded photo, persists it and asks the vision model about it
+    :return: (name, calorie_value)
+    """
+    # Normalize orientation, downsize and re-encode before anything leaves the server
+    processed = await process_image(raw)
+    logger.info(f"Image reduced from {processed.original_size} to {len(processed.data)} bytes "
+                f"({processed.width}x{processed.height})")
+
+    # Generate a unique name for the image, the user's container holds all of their images
+    random_num = uuid.uuid4()
+    image_name = f"image_{random_num}.{processed.extension}"
+    thumbnail_name = f"thumb_{random_num}.{processed.extension}"
+
+    if VISION_INLINE_IMAGES:
+        # Inference starts right away on the inline bytes. The upload is off the critical path and only follows a
+        # completed analysis, so requests shed by admission control or failing inference leave no orphaned blobs.
+        result = await _analyze_image(_data_url(processed), processed.detail)
+        _persist_in_background(container_name, image_name, thumbnail_name, processed)
+        return result
+
+    # The model fetches the public blob, so the upload has to finish first
+    image_url = await _persist_image(container_name, image_name, thumbnail_name, processed)
+    return await _analyze_image(image_url, processed.detail)
+
+
+def _parse_calories(calorie_value: str) -> Union[int, None]:
+    match = re.search(r"\d+", (calorie_value or "").replace(",", ""))
+    return int(match.group()) if match else None
+
+
+async def _batch_rate_limit(request: Request, image_files: List[UploadFile] = File(...)) -> None:
+    """
+    Charges the caller's rate limit one token per image instead of one per request
+    """
+    max_images = min(BATCH_MAX_IMAGES, int(limiter.capacity))
+    if len(image_files) > max_images:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail=f"At most {max_images} images are allowed per request")
+    await charge(request, cost=len(image_files))
+
 
 # Enable Python multipart form data
-@router.post("/get_calorie_value", tags=["ai_image"])
+@router.post("/get_calorie_value", tags=["ai_image"], dependencies=[Depends(llm_rate_limit)])
 async def get_calorie_value(email_id: Annotated[Union[str, None], Header()],
                             image_file: UploadFile = Form(...)):
     """
@@ -32,78 +196,81 @@ async def get_calorie_value(email_id: Annotated[Union[str, None], Header()],
     try:
         username = get_username_from_email(email_id)
         logger.info(f"Processing image for user: {username}")
-        print(image_file.content_type)
 
         # Validate image file type
-        if image_file.content_type not in ["image/jpeg", "image/jpg", "image/png"]:
+        if image_file.content_type not in ALLOWED_CONTENT_TYPES:
             return JSONResponse(content={"message": "Only .jpg/.jpeg/.png images are allowed"},
                                 status_code=status.HTTP_400_BAD_REQUEST)
 
-        # Generate a unique name for the image
-        random_num = uuid.uuid4()
-        image_name = f"image_{random_num}.jpg"
-        image_path = f"/tmp/{image_name}"
-
-        # Save the uploaded file locally
-        with open(image_path, "wb") as f:
-            f.write(await image_file.read())
-
-        # Create or get the user's container
-        container_name = username
-        container_client = azure_storage_client.get_container_client(container_name)
-
-        # Check if container exists, if not create it
-        try:
-            container_client.create_container(public_access=PublicAccess.Container)
-            logger.info(f"Created container for user: {container_name}")
-        except Exception as e:
-            logger.info(f"Container for user {container_name} already exists or another issue occurred: {str(e)}")
-
-        # Upload the file to Azure Blob Storage
-        blob_client = azure_storage_client.get_blob_client(container=container_name, blob=image_name)
-        with open(image_path, "rb") as data:
-            blob_client.upload_blob(data)
-
-        # Remove local file after uploading
-        os.remove(image_path)
-
-        # Construct the Azure Blob Storage URL for the uploaded image
-        azure_blob_url = f"https://calorieinfo.blob.core.windows.net/{container_name}/{image_name}"
-        logger.info(f"File uploaded to Azure Blob Storage: {azure_blob_url}")
-
-        # Use OpenAI Vision model (or another API) to process the image and get calorie data
-        response1 = vision_llm.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {
-                    "role": "user",
-                    "content": [
-                        {"type": "text", "text": "Guess the Calorie value of this food item from this image. Just give the number of calories, and no other chracter like around or about etc, "},
-                        {"type": "image_url", "image_url": {"url": azure_blob_url}},
-                    ],
-                }
-            ],
-            max_tokens=300,
-        )
-        response2 = vision_llm.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {
-                    "role": "user",
-                    "content": [
-                        {"type": "text",
-                         "text": "Guess the Food Item in this image. Just give the name of the dish "},
-                        {"type": "image_url", "image_url": {"url": azure_blob_url}},
-                    ],
-                }
-            ],
-            max_tokens=300,
-        )
+        name, calorie_value = await _analyze_upload(get_container_name_from_email(email_id), await image_file.read())
 
         # Return the response with the calorie value
-        return {"name": response2.choices[0].message.content, "calorie_value": response1.choices[0].message.content}
+        return {"name": name, "calorie_value": calorie_value}
 
+    except HTTPException:
+        # Shed by admission control, keep the 429 and its Retry-After
+        raise
     except Exception as e:
         logger.error(f"Error processing image for calorie value: {str(e)}")
         return JSONResponse(content={"message": "An error occurred while processing the image."},
                             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+@router.post("/get_calorie_values", tags=["ai_image"], dependencies=[Depends(_batch_rate_limit)])
+async def get_calorie_values(email_id: Annotated[Union[str, None], Header()],
+                             image_files: List[UploadFile] = File(...),
+                             save_to_log: bool = Form(False)):
+    """
+    Get calorie values of several food items (e.g. every plate of a meal) in one request.
+    Images are analysed concurrently, at most BATCH_CONCURRENCY at a time. Each image costs one rate limit token
+    and each vision call takes its own admission slot.
+
+    :param email_id: The email of the user
+    :param image_files: The uploaded image files
+    :param save_to_log: Also log every recognised item to calorie_data with a single bulk insert
+    :return: dict with per-image results and the combined calorie total
+    """
+    try:
+        username = get_username_from_email(email_id)
+        container_name = get_container_name_from_email(email_id)
+        logger.info(f"Processing {len(image_files)} images for user: {username}")
+
+        if any(image_file.content_type not in ALLOWED_CONTENT_TYPES for image_file in image_files):
+            return JSONResponse(content={"message": "Only .jpg/.jpeg/.png images are allowed"},
+                                status_code=status.HTTP_400_BAD_REQUEST)
+
+        semaphore = asyncio.Semaphore(BATCH_CONCURRENCY)
+
+        async def analyze(index: int, image_file: UploadFile) -> dict:
+            async with semaphore:
+                try:
+                    name, calorie_value = await _analyze_upload(container_name, await image_file.read())
+                    return {"index": index, "filename": image_file.filename, "name": name,
+                            "calorie_value": calorie_value, "calories": _parse_calories(calorie_value)}
+                except HTTPException as e:
+                    # Shed by admission control while the server is saturated
+                    return {"index": index, "filename": image_file.filename, "error": e.detail}
+                except Exception as e:
+                    logger.error(f"Error processing image {index} for calorie value: {str(e)}")
+                    return {"index": index, "filename": image_file.filename,
+                            "error": "An error occurred while processing the image."}
+
+        items = await asyncio.gather(*(analyze(index, image_file) for index, image_file in enumerate(image_files)))
+        recognised = [item for item in items if item.get("calories") is not None]
+        total_calories = sum(item["calories"] for item in recognised)
+
+        saved = 0
+        if save_to_log and recognised:
+            today_date = str(datetime.now().date())
+            await run_in_threadpool(calorie_collection.insert_many, [
+                {"email_id": email_id, "calorie": item["calories"], "food_item": item["name"], "date": today_date}
+                for item in recognised
+            ], ordered=False)
+            saved = len(recognised)
+
+        return {"items": items, "total_calories": total_calories, "saved": saved}
+
+    except Exception as e:
+        logger.error(f"Error processing images for calorie values: {str(e)}")
+        return JSONResponse(content={"message": "An error occurred while processing the images."},
+                            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
@@ -2,24 +2,55 @@ import logging
 from typing import Union, Annotated
 from fastapi import APIRouter, status, HTTPException
 from fastapi import Form, Header
-from starlette.responses import JSONResponse
-from settings.config import Config
 from datetime import datetime, timedelta
+from settings import retention
+from settings.encoding import NegotiatedResponse
+from settings.resources import LazyCollection
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-router = APIRouter()
-Config = Config()
-client = Config.get_mongo_client()
+router = APIRouter(default_response_class=NegotiatedResponse)
 
-db = client["nutrition_ai"]
-collection = db["calorie_data"]
+collection = LazyCollection("calorie_data")
+
+
+def ensure_indexes() -> None:
+    """
+    Creates the index behind the per-user, per-date lookups and the weekly aggregation
+    """
+    collection.create_index([("email_id", 1), ("date", 1)])
+
+
+def weekly_calorie_pipeline(email_id: str, start_date: str, end_date: str) -> list:
+    """
+    Day-by-day calorie totals between two YYYY-MM-DD dates, newest first. Also used by the query plan audit.
+    """
+    return [
+        {
+            # Match records within the range by comparing string dates
+            "$match": {
+                "email_id": email_id,
+                "date": {"$gte": start_date, "$lte": end_date}
+            }
+        },
+        {
+            # Group by date string and sum calories
+            "$group": {
+                "_id": "$date",
+                "total_calories": {"$sum": "$calorie"}
+            }
+        },
+        {
+            # Sort the results by date in descending order
+            "$sort": {"_id": -1}
+        }
+    ]
 
 
 @router.post("/write_calorie_to_mongo", tags=["calorie"])
 async def write_calorie_to_mongo(email_id: Annotated[Union[str, None], Header()],
-                                 calorie: int = Form(...), food_item: str = Form(...)) -> JSONResponse:
+                                 calorie: int = Form(...), food_item: str = Form(...)) -> NegotiatedResponse:
     """
     Writes data to mongo db
     :param email_id:
@@ -32,15 +63,15 @@ async def write_calorie_to_mongo(email_id: Annotated[Union[str, None], Header()]
         today_date = datetime.now().date()
         collection.insert_one(
             {"email_id": email_id, "calorie": calorie, "food_item": food_item, "date": str(today_date)})
-        return JSONResponse(status_code=status.HTTP_200_OK, content={"message": "Data written to mongo db"})
+        return NegotiatedResponse(status_code=status.HTTP_200_OK, content={"message": "Data written to mongo db"})
     except Exception as e:
         logger.error(f"Error in writing data to mongo db: {str(e)}")
-        return JSONResponse(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                            content={"message": "Internal server error"})
+        return NegotiatedResponse(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                                  content={"message": "Internal server error"})
 
 
 @router.get("/get_total_calorie_by_date/{email_id}/{date}", tags=["calorie"])
-async def get_total_calorie_by_date(email_id: str, date: str) -> JSONResponse:
+async def get_total_calorie_by_date(email_id: str, date: str) -> NegotiatedResponse:
     """
     Reads calorie data from MongoDB for a specific user (email_id) and date.
     :param email_id: The email ID of the user.
@@ -51,29 +82,38 @@ async def get_total_calorie_by_date(email_id: str, date: str) -> JSONResponse:
         # The date is already expected to be in the "YYYY-MM-DD" string format
         logger.info(f"Data received for reading from mongo db for email_id: {email_id} and date: {date}")
 
-        # Check if the email_id exists in the database
-        if email_id in collection.distinct("email_id"):
-            # Query to filter records by email_id and the exact date (which is stored as a string)
-            calorie_data = collection.find({"email_id": email_id, "date": date})
-
+        # Query to filter records by email_id and the exact date (which is stored as a string)
+        calorie_data = list(collection.find({"email_id": email_id, "date": date}, {"_id": 0, "calorie": 1}))
+        if calorie_data:
             # Calculate the total calorie intake for the specified date
             total_calories = sum([entry.get('calorie', 0) for entry in calorie_data])
+        else:
+            # Raw entries of older days may have expired after their roll up
+            total_calories = retention.load_daily_total(email_id, date)
 
+        if total_calories is not None:
             # Return the total calorie count in the response
-            return JSONResponse(status_code=200, content={"email_id": email_id, "date": date,
-                                                          "total_calories": total_calories})
+            return NegotiatedResponse(status_code=200, content={"email_id": email_id, "date": date,
+                                                                "total_calories": total_calories})
+        elif (collection.find_one({"email_id": email_id}, {"_id": 1}) is not None
+              or retention.has_daily_totals(email_id)):
+            return NegotiatedResponse(status_code=200, content={"email_id": email_id, "date": date,
+                                                                "total_calories": 0})
         else:
             # Handle case where email_id is not found
-            return JSONResponse(status_code=404, content={"message": "Email ID not found in database"})
+            return NegotiatedResponse(status_code=404, content={"message": "Email ID not found in database"})
     except Exception as e:
         logger.error(f"Error while fetching calorie data: {e}")
-        return JSONResponse(status_code=500, content={"message": "An error occurred while fetching calorie data"})
+        return NegotiatedResponse(status_code=500, content={"message": "An error occurred while fetching calorie data"})
 
 
 @router.get("/get_individual_calorie_by_date/{email_id}/{date}", tags=["calorie"])
-async def get_individual_calorie_by_date(email_id: str, date: str) -> JSONResponse:
+async def get_individual_calorie_by_date(email_id: str, date: str) -> NegotiatedResponse:
     """
     Reads calorie data from MongoDB for a specific user (email_id) and date.
+    Only raw entries are listed and they expire CALORIE_RAW_RETENTION_DAYS after their day is rolled up: older
+    days come back empty, or 404 once all of the user's entries have expired. Their totals remain available from
+    get_total_calorie_by_date.
     :param email_id: The email ID of the user.
     :param date: The date for which to retrieve the calorie data (YYYY-MM-DD).
     :return: Individual calorie count for the given date.
@@ -91,7 +131,8 @@ async def get_individual_calorie_by_date(email_id: str, date: str) -> JSONRespon
         )
         if calorie_data:
             # Return the individual calorie data for the specified date
-            return JSONResponse(status_code=200, content={"email_id": email_id, "date": date, "calorie_data": list(calorie_data)})
+            return NegotiatedResponse(status_code=200, content={"email_id": email_id, "date": date,
+                                                                "calorie_data": list(calorie_data)})
         else:
             raise HTTPException(status_code=404, detail="No calorie data found for the specified date")
     except HTTPException as http_err:
@@ -100,11 +141,11 @@ async def get_individual_calorie_by_date(email_id: str, date: str) -> JSONRespon
 
     except Exception as e:
         logger.error(f"Error while fetching calorie data: {e}")
-        return JSONResponse(status_code=500, content={"message": "An internal server error occurred"})
+        return NegotiatedResponse(status_code=500, content={"message": "An internal server error occurred"})
 
 
 @router.get("/get_weekly_calorie/{email_id}", tags=["calorie"])
-async def get_weekly_calorie(email_id: str) -> JSONResponse:
+async def get_weekly_calorie(email_id: str) -> NegotiatedResponse:
     """
     Gets the day-by-day total calorie consumption for the last 7 days for the specified user.
     :param email_id: The email ID of the user.
@@ -121,26 +162,7 @@ async def get_weekly_calorie(email_id: str) -> JSONResponse:
         week_ago_str = str(week_ago)
 
         # Aggregate day-by-day calorie data for the last 7 days
-        daily_calorie_cursor = collection.aggregate([
-            {
-                # Match records within the last 7 days by comparing string dates
-                "$match": {
-                    "email_id": email_id,
-                    "date": {"$gte": week_ago_str, "$lte": today_str}
-                }
-            },
-            {
-                # Group by date string and sum calories
-                "$group": {
-                    "_id": "$date",
-                    "total_calories": {"$sum": "$calorie"}
-                }
-            },
-            {
-                # Sort the results by date in descending order
-                "$sort": {"_id": -1}
-            }
-        ])
+        daily_calorie_cursor = collection.aggregate(weekly_calorie_pipeline(email_id, week_ago_str, today_str))
 
         # Convert the cursor to a list of daily calorie data
         daily_calorie_data = []
@@ -150,9 +172,9 @@ async def get_weekly_calorie(email_id: str) -> JSONResponse:
                 "total_calories": day_data["total_calories"]
             })
 
-        return JSONResponse(status_code=status.HTTP_200_OK, content={"daily_calorie_data": daily_calorie_data})
+        return NegotiatedResponse(status_code=status.HTTP_200_OK, content={"daily_calorie_data": daily_calorie_data})
 
     except Exception as e:
         logger.error(f"Error in fetching daily calorie data from MongoDB: {str(e)}")
-        return JSONResponse(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                            content={"message": "Internal server error"})
+        return NegotiatedResponse(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                                  content={"message": "Internal server error"})
@@ -0,0 +1,114 @@
+import asyncio
+import json
+import logging
+from datetime import datetime, timedelta
+from fastapi import APIRouter, status
+from starlette.concurrency import run_in_threadpool
+from routers.calorie import collection as calorie_collection
+from routers.mongo_crud_data import load_versioned
+from settings.encoding import NegotiatedResponse
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+router = APIRouter(default_response_class=NegotiatedResponse)
+
+
+def _load_profile(email_id: str):
+    data, _ = load_versioned("nutrition_app_user", email_id, "data")
+    return json.loads(data) if data is not None else None
+
+
+def calorie_summary_pipeline(email_id: str, today: str, week_ago: str) -> list:
+    """
+    One aggregation for both the 7-day series and today's entries, served by the {email_id, date} index
+    """
+    return [
+        {"$match": {"email_id": email_id, "date": {"$gte": week_ago, "$lte": today}}},
+        {"$facet": {
+            "daily": [
+                {"$group": {"_id": "$date", "total_calories": {"$sum": "$calorie"}}},
+                {"$sort": {"_id": -1}},
+            ],
+            "today": [
+                {"$match": {"date": today}},
+                {"$project": {"_id": 0, "food_item": 1, "calorie": 1}},
+            ],
+        }},
+    ]
+
+
+def _load_calorie_summary(email_id: str, today: str, week_ago: str) -> dict:
+    result = list(calorie_collection.aggregate(calorie_summary_pipeline(email_id, today, week_ago)))
+    facets = result[0] if result else {"daily": [], "today": []}
+    return {
+        "daily": [{"date": day["_id"], "total_calories": day["total_calories"]} for day in facets["daily"]],
+        "today": facets["today"],
+    }
+
+
+def _load_meal(email_id: str):
+    meal, _ = load_versioned("meal_data", email_id, "meal")
+    return meal if meal is not None else {}
+
+
+def _load_recommendation(email_id: str):
+    recommendation, _ = load_versioned("nutrition_recommendation_data", email_id, "recommendation")
+    if recommendation is None:
+        return {}
+    try:
+        return json.loads(recommendation)
+    except (TypeError, ValueError):
+        return recommendation
+
+
+@router.get("/{email_id}", tags=["dashboard"])
+async def get_dashboard(email_id: str) -> NegotiatedResponse:
+    """
+    Everything the home screen needs in one round trip: profile, today's total against the calorie goal,
+    the last 7 days, the meal plan and the latest recommendation. The queries run concurrently.
+    :param email_id: The email ID of the user.
+    :return:
+    """
+    try:
+        logger.info(f"Fetching dashboard for {email_id}")
+        today = datetime.now().date()
+        today_str = str(today)
+        week_ago_str = str(today - timedelta(days=7))
+
+        profile, calorie_summary, meal, recommendation = await asyncio.gather(
+            run_in_threadpool(_load_profile, email_id),
+            run_in_threadpool(_load_calorie_summary, email_id, today_str, week_ago_str),
+            run_in_threadpool(_load_meal, email_id),
+            run_in_threadpool(_load_recommendation, email_id),
+        )
+        if profile is None:
+            return NegotiatedResponse(status_code=status.HTTP_404_NOT_FOUND,
+                                      content={"message": "No data found in mongo db"})
+
+        total_calories = sum(entry.get("calorie", 0) for entry in calorie_summary["today"])
+        calorie_goal = profile.get("calorie_goal")
+        try:
+            remaining = float(calorie_goal) - total_calories
+        except (TypeError, ValueError):
+            remaining = None
+
+        return NegotiatedResponse(status_code=status.HTTP_200_OK, content={
+            "email_id": email_id,
+            "profile": profile,
+            "today": {
+                "date": today_str,
+                "total_calories": total_calories,
+                "calorie_goal": calorie_goal,
+                "remaining_calories": remaining,
+                "entries": calorie_summary["today"],
+            },
+            "daily_calorie_data": calorie_summary["daily"],
+            "meal": meal,
+            "recommendation": recommendation,
+        })
+
+    except Exception as e:
+        logger.error(f"Error in fetching dashboard: {str(e)}")
+        return NegotiatedResponse(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                                  content={"message": "Internal server error"})
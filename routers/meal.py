@@ -1,34 +1,23 @@
 import logging
 import json
 import os
-import requests
-from fastapi import APIRouter, Form, HTTPException, Header
+from fastapi import APIRouter, Depends, Form, HTTPException, Header
 from typing import Optional, Annotated, Union
-from langchain.prompts import PromptTemplate
-from langchain.chains import LLMChain
+from starlette.requests import Request
+from starlette.responses import Response
 from routers.mongo_crud_data import *
-from settings.config import Config
+from settings import model_routing, prompts
+from settings.encoding import NegotiatedResponse
+from settings.ratelimit import llm_admission
+from settings.caching import etag_matches, not_modified_response, set_cache_headers
 from settings.utils import json_cleaner
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-router = APIRouter()
-Config = Config()
-client = Config.get_mongo_client()
-chat_llm = Config.get_openai_chat_connection()
-@router.get("/generate_meal/{email}", tags=["meal"])
-def meal_generator(email_id):
-    """
-    Generate meals based on user's preferences
-    :param email_id:
-    :return:
-    """
-    try:
-        user_data = get_user_data_from_mongo(email_id)
-        if user_data is None or user_data == {}:
-            raise HTTPException(status_code=404, detail="User data not found in mongo db")
-        template = """You are an AI powered Meal generator, you will be provided with a user profile  {user_data} 
+router = APIRouter(default_response_class=NegotiatedResponse)
+
+MEAL_TEMPLATE = """You are an AI powered Meal generator, you will be provided with a user profile  {user_data} 
         containing information of "name", "age", "gender", //male, female, other "height", //in feet "weight", 
         //in lbs "activity_level", //sedentary, light, moderate, active, very_active "exercise_hours", //in hours 
         "job_type", //student, working "work_type", //office, field, home, None "work_hours", "cooking_hours", 
@@ -43,10 +32,21 @@ def meal_generator(email_id):
         REMEMBER: day, breakfast, lunch, dinner are the keys and the values are the meals for the day along with their calorie count per serving
         RESPONSE CONSTRAINT: DO NOT OUTPUT EXTRA CHARACTERS like 'json' or '```', JUST OUTPUT RESPONSE TO THE CUSTOMER IN PROPER TEXT AS JSON.
         """
+meal_chain = prompts.register("meal", MEAL_TEMPLATE, validate=model_routing.parses_as_json)
 
-        prompt = PromptTemplate.from_template(template)
-        chain = LLMChain(llm=chat_llm, prompt=prompt)
-        response_raw = chain.run(user_data=user_data)
+
+@router.get("/generate_meal/{email}", tags=["meal"], dependencies=[Depends(llm_admission)])
+def meal_generator(email_id):
+    """
+    Generate meals based on user's preferences
+    :param email_id:
+    :return:
+    """
+    try:
+        user_data = get_user_data_from_mongo(email_id)
+        if user_data is None or user_data == {}:
+            raise HTTPException(status_code=404, detail="User data not found in mongo db")
+        response_raw = meal_chain.run(user_data=user_data)
         response = json_cleaner(response_raw.strip())
         save_meal_to_mongo(email_id, response)
         return {"response": response}
@@ -59,16 +59,23 @@ def meal_generator(email_id):
 
 
 @router.get("/show_meal/{email}", tags=["meal"])
-def show_meal(email_id):
+def show_meal(email_id, request: Request, response: Response):
     """
-    Show meal from user's profile
+    Show meal from user's profile. Answers 304 when If-None-Match carries the stored etag.
     :param email_id:
+    :param request:
+    :param response:
     :return:
     """
     try:
-        meal = load_meal_from_mongo(email_id)
+        if request.headers.get("if-none-match"):
+            etag = load_etag("meal_data", email_id)
+            if etag_matches(request, etag):
+                return not_modified_response(etag)
+        meal, etag = load_versioned("meal_data", email_id, "meal")
         if meal is None:
-            raise HTTPException(status_code=404, detail="Meal not found in user's profile")
+            return {}
+        set_cache_headers(response, etag)
         return meal
 
     except Exception as e:
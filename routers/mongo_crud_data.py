@@ -1,30 +1,98 @@
+import hmac
 import json
 import logging
-from typing import Union, Annotated
+import os
+from typing import List, Union, Annotated
 from fastapi import APIRouter, status
-from fastapi import Form, Header
-from starlette.responses import JSONResponse
-from settings.config import Config
-from datetime import datetime, timedelta
+from fastapi import Body, Form, Header
+from pymongo.errors import OperationFailure
+from starlette.requests import Request
+from starlette.responses import Response
+from datetime import datetime, timedelta, timezone
+from settings.encoding import NegotiatedResponse
+from settings.caching import compute_etag, etag_matches, not_modified_response, set_cache_headers, cache_headers
+from settings import purge
+from settings.resources import LazyCollection, LazyDatabase
 from settings.utils import bmi_calculator
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-router = APIRouter()
-Config = Config()
-client = Config.get_mongo_client()
+router = APIRouter(default_response_class=NegotiatedResponse)
 
-db = client["nutrition_ai"]
-collection = db["nutrition_app_user"]
+db = LazyDatabase()
+collection = LazyCollection("nutrition_app_user")
+
+# Shared secret for the batch purge endpoint, unset disables it
+PURGE_ADMIN_TOKEN = os.environ.get("PURGE_ADMIN_TOKEN", "")
+
+# Collections holding one versioned document per user; each document carries an "etag" content hash of its payload
+VERSIONED_COLLECTIONS = ["nutrition_app_user", "meal_data", "grocery_data", "nutrition_recommendation_data"]
+# Covers the etag-only lookup; the planner would otherwise pick the unique email_id index and fetch the payload
+ETAG_INDEX = [("email_id", 1), ("etag", 1)]
+
+
+def _is_admin(admin_token: Union[str, None]) -> bool:
+    return bool(PURGE_ADMIN_TOKEN) and hmac.compare_digest(admin_token or "", PURGE_ADMIN_TOKEN)
+
+
+def _has_unique_email_index(collection_name: str) -> bool:
+    return any(index.get("unique") and [field for field, _ in index["key"]] == ["email_id"]
+               for index in db[collection_name].index_information().values())
+
+
+def ensure_indexes() -> None:
+    """
+    Creates the indexes behind the per-user lookups. {email_id, etag} covers the If-None-Match version check,
+    the unique email_id index keeps upserts on the user's single document. The unique index cannot be built while
+    the duplicates left by the old insert-per-save code exist; `python -m settings.retention migrate` archives
+    them and builds it.
+    """
+    for name in VERSIONED_COLLECTIONS:
+        db[name].create_index(ETAG_INDEX)
+        if _has_unique_email_index(name):
+            continue
+        try:
+            db[name].create_index("email_id", unique=True)
+        except OperationFailure as e:
+            # E11000 duplicate key, the migration has not run yet
+            if e.code != 11000:
+                raise
+            logger.warning(f"{name} holds several documents per user, run python -m settings.retention migrate: "
+                           f"{str(e)}")
+    db["chat_data"].create_index([("email_id", 1)])
+
+
+def load_etag(collection_name: str, email: str) -> Union[str, None]:
+    """
+    Reads only the stored version of a user's document, answered from the {email_id, etag} index
+    """
+    data = db[collection_name].find_one({"email_id": email}, {"_id": 0, "etag": 1}, hint=ETAG_INDEX)
+    return data.get("etag") if data else None
+
+
+def load_versioned(collection_name: str, email: str, field: str) -> tuple:
+    """
+    Reads a user's payload together with its etag, backfilling the etag of documents written before versioning
+    :return: (payload, etag) or (None, None) when the user has no document
+    """
+    data = db[collection_name].find_one({"email_id": email}, {"_id": 0, field: 1, "etag": 1})
+    if data is None or field not in data:
+        return None, None
+    etag = data.get("etag")
+    if etag is None:
+        etag = compute_etag(data[field])
+        db[collection_name].update_one({"email_id": email, "etag": {"$exists": False}}, {"$set": {"etag": etag}})
+    return data[field], etag
 
 
 def save_recommendation_to_mongo(email: str, recommendation: str) -> None:
     try:
         collection_recommendation = db['nutrition_recommendation_data']
-        if email in collection_recommendation.distinct("email_id"):
-            collection_recommendation.update_one({"email_id": email}, {"$set": {"recommendation": recommendation}})
-        collection_recommendation.insert_one({"email_id": email, "recommendation": recommendation})
+        collection_recommendation.update_one(
+            {"email_id": email},
+            {"$set": {"recommendation": recommendation, "etag": compute_etag(recommendation)}},
+            upsert=True)
         return None
     except Exception as e:
         logger.error(f"Error in writing recommendation data to mongo db: {str(e)}")
@@ -34,9 +102,10 @@ def save_recommendation_to_mongo(email: str, recommendation: str) -> None:
 def save_chat_to_mongo(email: str, history: str) -> None:
     try:
         collection_chat = db['chat_data']
-        if email in collection_chat.distinct("email_id"):
-            collection_chat.update_one({"email_id": email}, {"$set": {"history": history}})
-        collection_chat.insert_one({"email_id": email, "history": history})
+        # history is the whole conversation, keep one document per user; updated_at drives retention
+        collection_chat.update_one({"email_id": email},
+                                   {"$set": {"history": history, "updated_at": datetime.now(timezone.utc)}},
+                                   upsert=True)
         return None
     except Exception as e:
         logger.error(f"Error in writing chat data to mongo db: {str(e)}")
@@ -46,9 +115,8 @@ def save_chat_to_mongo(email: str, history: str) -> None:
 def save_meal_to_mongo(email: str, meal: dict) -> None:
     try:
         collection_meal = db['meal_data']
-        if email in collection_meal.distinct("email_id"):
-            collection_meal.update_one({"email_id": email}, {"$set": {"meal": meal}})
-        collection_meal.insert_one({"email_id": email, "meal": meal})
+        collection_meal.update_one({"email_id": email}, {"$set": {"meal": meal, "etag": compute_etag(meal)}},
+                                   upsert=True)
         return None
     except Exception as e:
         logger.error(f"Error in writing meal data to mongo db: {str(e)}")
@@ -58,8 +126,8 @@ def save_meal_to_mongo(email: str, meal: dict) -> None:
 def load_meal_from_mongo(email: str) -> dict:
     try:
         collection_meal = db['meal_data']
-        if email in collection_meal.distinct("email_id"):
-            data = collection_meal.find_one({"email_id": email}, {"_id": 0})
+        data = collection_meal.find_one({"email_id": email}, {"_id": 0, "meal": 1})
+        if data is not None:
             return data['meal']
         else:
             return {}
@@ -71,9 +139,10 @@ def load_meal_from_mongo(email: str) -> dict:
 def save_grocery_list_to_mongo(email: str, grocery_list: dict) -> None:
     try:
         collection_grocery = db['grocery_data']
-        if email in collection_grocery.distinct("email_id"):
-            collection_grocery.update_one({"email_id": email}, {"$set": {"grocery_list": grocery_list}})
-        collection_grocery.insert_one({"email_id": email, "grocery_list": grocery_list})
+        collection_grocery.update_one(
+            {"email_id": email},
+            {"$set": {"grocery_list": grocery_list, "etag": compute_etag(grocery_list)}},
+            upsert=True)
         return None
     except Exception as e:
         logger.error(f"Error in writing grocery list data to mongo db: {str(e)}")
@@ -83,8 +152,8 @@ def save_grocery_list_to_mongo(email: str, grocery_list: dict) -> None:
 def load_grocery_list_from_mongo(email: str) -> dict:
     try:
         collection_grocery = db['grocery_data']
-        if email in collection_grocery.distinct("email_id"):
-            data = collection_grocery.find_one({"email_id": email}, {"_id": 0})
+        data = collection_grocery.find_one({"email_id": email}, {"_id": 0, "grocery_list": 1})
+        if data is not None:
             return data['grocery_list']
         else:
             return {}
@@ -147,7 +216,7 @@ def verify_data(data: str) -> bool:
 
 @router.post("/write_user_info_to_mongo", tags=["mongo_db"])
 async def write_user_info_to_mongo(email_id: Annotated[Union[str, None], Header()],
-                                   data: str = Form(...)) -> JSONResponse:
+                                   data: str = Form(...)) -> NegotiatedResponse:
     """
        Writes data to mongo db
        data =
@@ -189,43 +258,50 @@ async def write_user_info_to_mongo(email_id: Annotated[Union[str, None], Header(
             if not bmi:
                 bmi = ""
             logger.info(f"Data received for writing to mongo db")
-            if email_id in collection.distinct("email_id"):
-                collection.update_one({"email_id": email_id}, {"$set": {"data": data}})
-            else:
-                collection.insert_one({"email_id": email_id, "data": data})
-            return JSONResponse(status_code=status.HTTP_200_OK, content={"message": "Data written to mongo db", "bmi": bmi})
+            collection.update_one({"email_id": email_id}, {"$set": {"data": data, "etag": compute_etag(data)}},
+                                  upsert=True)
+            return NegotiatedResponse(status_code=status.HTTP_200_OK,
+                                      content={"message": "Data written to mongo db", "bmi": bmi})
         except Exception as e:
             logger.error(f"Error in writing data to mongo db: {str(e)}")
-            return JSONResponse(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                                content={"message": "Internal server error"})
+            return NegotiatedResponse(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                                      content={"message": "Internal server error"})
     else:
-        return JSONResponse(status_code=status.HTTP_400_BAD_REQUEST,
-                            content={"message": "Invalid data"})
+        return NegotiatedResponse(status_code=status.HTTP_400_BAD_REQUEST,
+                                  content={"message": "Invalid data"})
 
 
 @router.get("/read_user_info_from_mongo/{email}", tags=["mongo_db"])
-async def read_user_info_from_mongo(email_id: str) -> JSONResponse:
+async def read_user_info_from_mongo(email_id: str, request: Request) -> Response:
     """
-    Reads data from mongo db
+    Reads data from mongo db. Answers 304 when If-None-Match carries the stored etag.
     :param email_id:
+    :param request:
     :return:
     """
     try:
         logger.info(f"Data received for reading from mongo db")
-        if email_id in collection.distinct("email_id"):
-            data = collection.find_one({"email_id": email_id}, {"_id": 0})
-            return JSONResponse(status_code=status.HTTP_200_OK, content={"message": "Data fetched from mongo db",
-                                                                         "data": data})
+        if request.headers.get("if-none-match"):
+            etag = load_etag("nutrition_app_user", email_id)
+            if etag_matches(request, etag):
+                return not_modified_response(etag)
+        data, etag = load_versioned("nutrition_app_user", email_id, "data")
+        if data is not None:
+            return NegotiatedResponse(status_code=status.HTTP_200_OK, content={"message": "Data fetched from mongo db",
+                                                                               "data": {"email_id": email_id,
+                                                                                        "data": data}},
+                                      headers=cache_headers(etag))
         else:
-            return JSONResponse(status_code=status.HTTP_404_NOT_FOUND, content={"message": "No data found in mongo db"})
+            return NegotiatedResponse(status_code=status.HTTP_404_NOT_FOUND,
+                                      content={"message": "No data found in mongo db"})
     except Exception as e:
         logger.error(f"Error in reading data from mongo db: {str(e)}")
-        return JSONResponse(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                            content={"message": "Internal server error"})
+        return NegotiatedResponse(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                                  content={"message": "Internal server error"})
 
 
 @router.get("/get_all_chats/{email_id}", tags=["mongo_db"])
-async def get_all_chats(email_id: str) -> JSONResponse:
+async def get_all_chats(email_id: str) -> NegotiatedResponse:
     """
     Reads data from mongo db
     :param email_id:
@@ -235,44 +311,74 @@ async def get_all_chats(email_id: str) -> JSONResponse:
         logger.info(f"Data received for reading from mongo db")
         collection_chat = db['chat_data']
         if email_id in collection_chat.distinct("email_id"):
-            data = collection_chat.find({"email_id": email_id}, {"_id": 0})
-            return JSONResponse(status_code=status.HTTP_200_OK, content={"message": "Data fetched from mongo db",
-                                                                         "data": data})
+            data = list(collection_chat.find({"email_id": email_id}, {"_id": 0}))
+            return NegotiatedResponse(status_code=status.HTTP_200_OK, content={"message": "Data fetched from mongo db",
+                                                                               "data": data})
         else:
-            return JSONResponse(status_code=status.HTTP_404_NOT_FOUND, content={"message": "No data found in mongo db"})
+            return NegotiatedResponse(status_code=status.HTTP_404_NOT_FOUND,
+                                      content={"message": "No data found in mongo db"})
     except Exception as e:
         logger.error(f"Error in reading data from mongo db: {str(e)}")
-        return JSONResponse(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                            content={"message": "Internal server error"})
+        return NegotiatedResponse(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                                  content={"message": "Internal server error"})
 
 
 @router.delete("/delete_user_info_from_mongo/{email_id}", tags=["mongo_db"])
-async def delete_user_info_from_mongo(email_id: str) -> JSONResponse:
+async def delete_user_info_from_mongo(email_id: str) -> NegotiatedResponse:
     """
-    Deletes data from mongo db
+    Deletes all of the user's data: every collection in one bulk pass, the blob container in the background
     :param email_id:
     :return:
     """
     try:
         logger.info(f"Data received for deleting from mongo db")
-        if email_id in collection.distinct("email_id"):
-            collection.delete_many({"email_id": email_id})
-            return JSONResponse(status_code=status.HTTP_200_OK, content={"message": "Data deleted from mongo db"})
+        result = await purge.purge_users([email_id])
+        if any(result["documents"].values()):
+            return NegotiatedResponse(status_code=status.HTTP_200_OK, content={"message": "Data deleted from mongo db",
+                                                                               "deleted": result["documents"]})
         else:
-            return JSONResponse(status_code=status.HTTP_404_NOT_FOUND, content={"message": "No data found in mongo db"})
+            return NegotiatedResponse(status_code=status.HTTP_404_NOT_FOUND,
+                                      content={"message": "No data found in mongo db"})
     except Exception as e:
         logger.error(f"Error in deleting data from mongo db: {str(e)}")
-        return JSONResponse(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                            content={"message": "Internal server error"})
+        return NegotiatedResponse(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                                  content={"message": "Internal server error"})
+
+
+@router.post("/purge_users", tags=["mongo_db"])
+async def purge_users(email_ids: List[str] = Body(...),
+                      admin_token: Annotated[Union[str, None], Header()] = None) -> NegotiatedResponse:
+    """
+    Batch account deletion for thousands of users, see settings.purge. Disabled unless PURGE_ADMIN_TOKEN is set
+    and sent in the admin-token header.
+    :param email_ids: JSON list of emails
+    :param admin_token:
+    :return:
+    """
+    if not _is_admin(admin_token):
+        return NegotiatedResponse(status_code=status.HTTP_403_FORBIDDEN, content={"message": "Forbidden"})
+    try:
+        logger.info(f"Received {len(email_ids)} users to purge")
+        result = await purge.purge_users(email_ids)
+        return NegotiatedResponse(status_code=status.HTTP_200_OK, content={"message": "Users purged", **result})
+    except Exception as e:
+        logger.error(f"Error in purging users: {str(e)}")
+        return NegotiatedResponse(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                                  content={"message": "Internal server error"})
 
 
 @router.get("/get_old_recommendation/{email_id}", tags=["mongo_db"])
-def get_old_recommendation_from_mongo(email_id: str) -> dict:
+def get_old_recommendation_from_mongo(email_id: str, request: Request, response: Response):
     try:
-        collection_recommendation = db['nutrition_recommendation_data']
-        if email_id in collection_recommendation.distinct("email_id"):
-            data = collection_recommendation.find_one({"email_id": email_id}, {"_id": 0})
-            return json.loads(data['recommendation'])
+        if request.headers.get("if-none-match"):
+            etag = load_etag("nutrition_recommendation_data", email_id)
+            if etag_matches(request, etag):
+                return not_modified_response(etag)
+        recommendation, etag = load_versioned("nutrition_recommendation_data", email_id, "recommendation")
+        if recommendation is not None:
+            data = json.loads(recommendation)
+            set_cache_headers(response, etag)
+            return data
         else:
             return {}
     except Exception as e:
@@ -0,0 +1,56 @@
+import hashlib
+import json
+import logging
+import os
+
+from starlette.requests import Request
+from starlette.responses import Response
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Clients may keep a copy but must revalidate it with If-None-Match on every poll
+CACHE_CONTROL = os.environ.get("READ_CACHE_CONTROL", "private, no-cache")
+
+
+def compute_etag(value) -> str:
+    """
+    Content hash stored next to a document's payload and served as its ETag
+    :param value: Any JSON-serializable payload (str, dict, list)
+    :return: Hex digest
+    """
+    if not isinstance(value, str):
+        value = json.dumps(value, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.blake2b(value.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def _quoted(etag: str) -> str:
+    # Weak validator: the same document may be served with different encodings
+    return f'W/"{etag}"'
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    """
+    Checks the request's If-None-Match header against a stored etag
+    """
+    header = request.headers.get("if-none-match")
+    if not header or not etag:
+        return False
+    if header.strip() == "*":
+        return True
+    candidates = {candidate.strip().removeprefix("W/") for candidate in header.split(",")}
+    return f'"{etag}"' in candidates
+
+
+def cache_headers(etag: str) -> dict:
+    if not etag:
+        return {"Cache-Control": CACHE_CONTROL}
+    return {"ETag": _quoted(etag), "Cache-Control": CACHE_CONTROL}
+
+
+def set_cache_headers(response: Response, etag: str) -> None:
+    response.headers.update(cache_headers(etag))
+
+
+def not_modified_response(etag: str) -> Response:
+    return Response(status_code=304, headers=cache_headers(etag))
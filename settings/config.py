@@ -1,10 +1,8 @@
 import logging
 import os
-from langchain_openai import ChatOpenAI as OpenAI
 import pymongo
 import certifi
-from openai import OpenAI as visionopenai
-from azure.storage.blob import BlobServiceClient
+from settings.metrics import MongoCommandTimer
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -12,6 +10,7 @@ logger = logging.getLogger(__name__)
 
 class Config:
     _instance = None
+    _mongomock_client = None
 
     @staticmethod
     def get_instance():
@@ -29,7 +28,10 @@ class Config:
         try:
             self.open_ai_key = os.environ["OPENAI_API_KEY"]
             self.mongo_uri = os.environ["MONGO_URI"]
+            self.mongo_tls = os.environ.get("MONGO_TLS", "true").lower() == "true"
             self.azure_storage_name = "calorieinfo"
+            self.azure_storage_account_url = os.environ.get("AZURE_STORAGE_ACCOUNT_URL",
+                                                            "https://calorieinfo.blob.core.windows.net")
             self.azure_storage_connection_string = os.environ["AZURE_STORAGE_CONN_STRING"]
             self.azure_storage_key = os.environ["AZURE_STORAGE_KEY"]
 
@@ -40,7 +42,17 @@ class Config:
     def get_mongo_client(self):
         try:
             logger.info("Connecting to MongoDB")
-            client = pymongo.MongoClient(os.environ['MONGO_URI'], ssl=True, tlsCAFile=certifi.where())
+            if self.mongo_uri.startswith("mongomock://"):
+                # In-process stand-in used by the benchmark suite, shared so every router sees the same data
+                import mongomock
+                if Config._mongomock_client is None:
+                    Config._mongomock_client = mongomock.MongoClient()
+                client = Config._mongomock_client
+            elif self.mongo_tls:
+                client = pymongo.MongoClient(self.mongo_uri, ssl=True, tlsCAFile=certifi.where(),
+                                             event_listeners=[MongoCommandTimer()])
+            else:
+                client = pymongo.MongoClient(self.mongo_uri, event_listeners=[MongoCommandTimer()])
             client.admin.command('ping')
             logger.info(f"Connected to MongoDB")
             return client
@@ -51,7 +63,10 @@ class Config:
     def get_openai_chat_connection(self):
         try:
             logger.info("Connecting to GPT-4o's Latest Variant")
-            chat_llm = OpenAI(max_tokens=4000, temperature=0.6, model='gpt-4o')
+            # Deferred: langchain is by far the most expensive import in the app
+            from langchain_openai import ChatOpenAI as OpenAI
+            from settings.llm_callbacks import LLMUsageCallback
+            chat_llm = OpenAI(max_tokens=4000, temperature=0.6, model='gpt-4o', callbacks=[LLMUsageCallback()])
             if chat_llm is None:
                 raise Exception("Error in connecting to GPT-4o's Latest Variant")
             else:
@@ -64,6 +79,7 @@ class Config:
     def get_openai_vision_connection(self):
         try:
             logger.info("Connecting to OpenAI Vision")
+            from openai import OpenAI as visionopenai
             vision_client = visionopenai()
             if vision_client is None:
                 raise Exception("Error in connecting to OpenAI Vision")
@@ -77,7 +93,8 @@ class Config:
     def get_azure_storage_client(self):
         try:
             logger.info("Connecting to Azure Storage")
-            service = BlobServiceClient(account_url="https://calorieinfo.blob.core.windows.net",
+            from azure.storage.blob import BlobServiceClient
+            service = BlobServiceClient(account_url=self.azure_storage_account_url,
                                         credential=self.azure_storage_key)
             if service:
                 logger.info("Connected to Azure Storage")
@@ -0,0 +1,142 @@
+import gzip
+import logging
+import os
+from contextvars import ContextVar
+
+import brotli
+import msgpack
+import orjson
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.responses import Response
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+MSGPACK_MEDIA_TYPES = ("application/msgpack", "application/x-msgpack", "application/vnd.msgpack")
+COMPRESSIBLE_MEDIA_TYPES = ("application/json", "application/msgpack", "text/")
+
+# Bodies smaller than this are sent uncompressed, the framing overhead is not worth it
+COMPRESSION_MIN_SIZE = int(os.environ.get("COMPRESSION_MIN_SIZE", "1024"))
+BROTLI_QUALITY = int(os.environ.get("BROTLI_QUALITY", "4"))
+GZIP_LEVEL = int(os.environ.get("GZIP_LEVEL", "5"))
+
+# Accept header of the request being served, read by NegotiatedResponse when it renders
+_accept = ContextVar("accept", default="")
+
+
+def _default(value):
+    # Mongo documents may still carry datetimes or ObjectIds
+    return str(value)
+
+
+def wants_msgpack(accept: str) -> bool:
+    return any(media_type in accept for media_type in MSGPACK_MEDIA_TYPES)
+
+
+def encode(content, accept: str) -> tuple:
+    """
+    Serializes content as MessagePack when the client asks for it, orjson-encoded JSON otherwise
+    :param content: JSON-compatible payload
+    :param accept: Value of the request's Accept header
+    :return: (body, media_type)
+    """
+    if wants_msgpack(accept):
+        return msgpack.packb(content, default=_default), MSGPACK_MEDIA_TYPES[0]
+    return orjson.dumps(content, default=_default, option=orjson.OPT_NON_STR_KEYS), "application/json"
+
+
+class NegotiatedResponse(Response):
+    """
+    Drop-in replacement for JSONResponse that honours Accept: application/msgpack and uses orjson for JSON
+    """
+    media_type = "application/json"
+
+    def render(self, content) -> bytes:
+        body, self.media_type = encode(content, _accept.get())
+        return body
+
+    def init_headers(self, headers=None) -> None:
+        super().init_headers(headers)
+        self.raw_headers.append((b"vary", b"Accept"))
+
+
+def _accepted_encodings(accept_encoding: str) -> set:
+    encodings = set()
+    for item in accept_encoding.lower().split(","):
+        token, _, params = item.strip().partition(";")
+        if params.strip().replace(" ", "") in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+            continue
+        encodings.add(token.strip())
+    return encodings
+
+
+def compress(body: bytes, accept_encoding: str) -> tuple:
+    """
+    Compresses body with Brotli or gzip depending on what the client accepts
+    :return: (body, content_encoding) where content_encoding is None when left uncompressed
+    """
+    encodings = _accepted_encodings(accept_encoding)
+    if "br" in encodings:
+        return brotli.compress(body, quality=BROTLI_QUALITY), "br"
+    if "gzip" in encodings:
+        return gzip.compress(body, compresslevel=GZIP_LEVEL), "gzip"
+    return body, None
+
+
+class ContentEncodingMiddleware:
+    """
+    Pure ASGI middleware that records the Accept header for NegotiatedResponse and compresses complete response
+    bodies above COMPRESSION_MIN_SIZE with Brotli or gzip. Streaming responses pass through untouched.
+    """
+
+    def __init__(self, app, minimum_size: int = COMPRESSION_MIN_SIZE):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request_headers = Headers(scope=scope)
+        token = _accept.set(request_headers.get("accept", ""))
+        accept_encoding = request_headers.get("accept-encoding", "")
+        if not accept_encoding:
+            try:
+                await self.app(scope, receive, send)
+            finally:
+                _accept.reset(token)
+            return
+
+        start_message = None
+
+        async def send_wrapper(message):
+            nonlocal start_message
+            if message["type"] == "http.response.start":
+                start_message = message
+                return
+            if message["type"] != "http.response.body" or start_message is None:
+                await send(message)
+                return
+
+            pending_start, start_message = start_message, None
+            body = message.get("body", b"")
+            headers = MutableHeaders(raw=pending_start["headers"])
+            compressible = (not message.get("more_body", False)
+                            and len(body) >= self.minimum_size
+                            and "content-encoding" not in headers
+                            and headers.get("content-type", "").startswith(COMPRESSIBLE_MEDIA_TYPES))
+            if compressible:
+                body, content_encoding = compress(body, accept_encoding)
+                if content_encoding is not None:
+                    headers["Content-Encoding"] = content_encoding
+                    headers["Content-Length"] = str(len(body))
+                    headers.add_vary_header("Accept-Encoding")
+                    message = {**message, "body": body}
+            await send(pending_start)
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _accept.reset(token)
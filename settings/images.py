@@ -0,0 +1,119 @@
+import asyncio
+import io
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from typing import NamedTuple
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+IMAGE_MAX_EDGE = int(os.environ.get("IMAGE_MAX_EDGE", "1024"))
+IMAGE_FORMAT = os.environ.get("IMAGE_FORMAT", "WEBP").upper()
+IMAGE_QUALITY = int(os.environ.get("IMAGE_QUALITY", "80"))
+THUMBNAIL_EDGE = int(os.environ.get("THUMBNAIL_EDGE", "256"))
+# low, high or auto. Low detail (a single 512px tile) is enough to name a dish and estimate its calories.
+VISION_DETAIL = os.environ.get("VISION_DETAIL", "low")
+LOW_DETAIL_EDGE = 512
+IMAGE_WORKERS = int(os.environ.get("IMAGE_WORKERS", str(max(1, (os.cpu_count() or 2) // 2))))
+
+FORMATS = {
+    "WEBP": ("image/webp", "webp"),
+    "JPEG": ("image/jpeg", "jpg"),
+}
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+class ProcessedImage(NamedTuple):
+    data: bytes
+    thumbnail: bytes
+    content_type: str
+    extension: str
+    width: int
+    height: int
+    original_size: int
+    detail: str
+
+
+def _vision_detail(width: int, height: int) -> str:
+    if VISION_DETAIL != "auto":
+        return VISION_DETAIL
+    return "low" if max(width, height) <= LOW_DETAIL_EDGE else "high"
+
+
+def preprocess_image(raw: bytes, max_edge: int = IMAGE_MAX_EDGE, image_format: str = IMAGE_FORMAT,
+                     quality: int = IMAGE_QUALITY, thumbnail_edge: int = THUMBNAIL_EDGE) -> ProcessedImage:
+    """
+    Normalizes EXIF orientation, downsizes to max_edge, re-encodes and renders a thumbnail.
+    CPU bound, meant to run in the process pool via process_image().
+    :param raw: Bytes of the uploaded photo
+    :param max_edge: Longest edge of the stored/analysed image in pixels
+    :param image_format: WEBP or JPEG
+    :param quality: Encoder quality
+    :param thumbnail_edge: Longest edge of the thumbnail in pixels
+    :return: ProcessedImage
+    """
+    from PIL import Image, ImageOps
+
+    content_type, extension = FORMATS[image_format]
+    with Image.open(io.BytesIO(raw)) as image:
+        # Lets the JPEG decoder downscale by a power of two while decoding, far cheaper than a full decode
+        image.draft("RGB", (max_edge, max_edge))
+        image = ImageOps.exif_transpose(image)
+        if image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+        image.thumbnail((max_edge, max_edge), Image.LANCZOS)
+
+        buffer = io.BytesIO()
+        image.save(buffer, format=image_format, quality=quality, optimize=True)
+        thumbnail = image.copy()
+        thumbnail.thumbnail((thumbnail_edge, thumbnail_edge), Image.LANCZOS)
+        thumbnail_buffer = io.BytesIO()
+        thumbnail.save(thumbnail_buffer, format=image_format, quality=quality)
+
+        return ProcessedImage(data=buffer.getvalue(), thumbnail=thumbnail_buffer.getvalue(),
+                              content_type=content_type, extension=extension, width=image.width,
+                              height=image.height, original_size=len(raw),
+                              detail=_vision_detail(image.width, image.height))
+
+
+def get_executor() -> ProcessPoolExecutor:
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                # spawn: forking a process that already runs threads (uvicorn's threadpool) is not safe
+                _executor = ProcessPoolExecutor(max_workers=IMAGE_WORKERS,
+                                                mp_context=multiprocessing.get_context("spawn"))
+    return _executor
+
+
+def shutdown_executor() -> None:
+    global _executor
+    with _executor_lock:
+        executor, _executor = _executor, None
+    if executor is not None:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+async def process_image(raw: bytes) -> ProcessedImage:
+    """
+    Runs preprocess_image in the process pool without blocking the event loop
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_executor(), partial(preprocess_image, raw))
+
+
+def _forget_after_fork() -> None:
+    # The parent's pool and its pipes cannot be used from a forked child
+    global _executor, _executor_lock
+    _executor = None
+    _executor_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_forget_after_fork)
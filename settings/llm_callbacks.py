@@ -0,0 +1,36 @@
+import logging
+import time
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+from settings.metrics import record_llm_usage
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class LLMUsageCallback(BaseCallbackHandler):
+    """
+    langchain callback recording latency and prompt/completion tokens of every chat model call
+    """
+
+    def __init__(self):
+        self._started = {}
+
+    def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+        self._started[run_id] = time.perf_counter()
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        self._started[run_id] = time.perf_counter()
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        start = self._started.pop(run_id, None)
+        if start is None:
+            return
+        llm_output = response.llm_output or {}
+        token_usage = llm_output.get("token_usage") or {}
+        record_llm_usage(llm_output.get("model_name", "unknown"), time.perf_counter() - start,
+                         token_usage.get("prompt_tokens", 0), token_usage.get("completion_tokens", 0))
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._started.pop(run_id, None)
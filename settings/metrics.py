@@ -0,0 +1,212 @@
+import logging
+import os
+import re
+import time
+from contextvars import ContextVar
+
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Histogram, generate_latest
+from prometheus_client import multiprocess
+from pymongo import monitoring
+from starlette.responses import Response
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds",
+    "Latency of HTTP requests by route template",
+    ["method", "route", "status"],
+)
+MONGO_COMMAND_LATENCY = Histogram(
+    "mongo_command_duration_seconds",
+    "Latency of MongoDB commands by collection and operation",
+    ["collection", "command"],
+    buckets=(.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1.0, 2.5, 5.0),
+)
+MONGO_COMMAND_FAILURES = Counter(
+    "mongo_command_failures_total",
+    "Failed MongoDB commands by collection and operation",
+    ["collection", "command"],
+)
+LLM_LATENCY = Histogram(
+    "llm_request_duration_seconds",
+    "Latency of LLM calls by endpoint and model",
+    ["endpoint", "model"],
+    buckets=(.25, .5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0),
+)
+LLM_TOKENS = Counter(
+    "llm_tokens_total",
+    "LLM tokens consumed by endpoint, model and kind (prompt/completion)",
+    ["endpoint", "model", "kind"],
+)
+LLM_ADMISSION_REJECTIONS = Counter(
+    "llm_admission_rejections_total",
+    "LLM requests rejected with 429 by reason (user_rate_limit, queue_full, queue_timeout)",
+    ["reason"],
+)
+LLM_ROUTE_DECISIONS = Counter(
+    "llm_route_decisions_total",
+    "Model routing decisions by request class, routed model and outcome (routed, fallback_only, fallback_<reason>)",
+    ["request_class", "model", "outcome"],
+)
+LLM_ROUTE_LATENCY = Histogram(
+    "llm_route_duration_seconds",
+    "End to end latency of routed LLM requests including any fallback call, by request class and outcome",
+    ["request_class", "outcome"],
+    buckets=(.25, .5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0),
+)
+LLM_ROUTING_TOKENS = Counter(
+    "llm_routing_tokens_total",
+    "Tokens answered by a routed smaller model instead of the fallback model (offloaded) and tokens of "
+    "rejected routed answers (wasted), by request class",
+    ["request_class", "kind"],
+)
+
+# Holds the ASGI scope of the request being served and its path as received, so that LLM and Mongo hooks
+# can label their samples with the matched route template.
+_current_request = ContextVar("current_request", default=None)
+
+_PATH_PARAM = re.compile(r"{(\w+)(?::\w+)?}")
+
+
+def request_path(scope) -> str:
+    """
+    Path of the request relative to the application, to be taken before routing rewrites the scope
+    """
+    path, root_path = scope["path"], scope.get("root_path", "")
+    if root_path and path.startswith(root_path):
+        return path[len(root_path):]
+    return path
+
+
+def route_template(scope, path: str) -> str:
+    """
+    Template of the matched route including its router prefix, e.g. /meal/generate_meal/{email}.
+    Depending on the FastAPI version route.path of an included route may lack the prefix, so the prefix is taken
+    from the request path: whatever precedes the route's own path filled in with the path params.
+    :param scope: ASGI scope after routing
+    :param path: request_path() of the scope before routing
+    """
+    route = scope.get("route")
+    if route is None:
+        return "unmatched"
+    params = scope.get("path_params") or {}
+    rendered = _PATH_PARAM.sub(lambda match: str(params.get(match.group(1), match.group(0))), route.path)
+    if rendered and path.endswith(rendered):
+        return path[:len(path) - len(rendered)] + route.path
+    return route.path
+
+
+def current_endpoint() -> str:
+    """
+    Returns the route template of the request being served, e.g. /meal/generate_meal/{email}
+    """
+    current = _current_request.get()
+    if current is None:
+        return "background"
+    scope, path = current
+    return route_template(scope, path)
+
+
+class MetricsMiddleware:
+    """
+    Pure ASGI middleware recording per-route latency. Routes are labelled by their template rather than the
+    raw path so that email ids in the URL do not blow up label cardinality.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        token = _current_request.set((scope, request_path(scope)))
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            REQUEST_LATENCY.labels(scope["method"], current_endpoint(), str(status_code)).observe(
+                time.perf_counter() - start)
+            _current_request.reset(token)
+
+
+class MongoCommandTimer(monitoring.CommandListener):
+    """
+    pymongo command listener recording the server round trip of every command per collection/operation
+    """
+
+    def __init__(self):
+        self._pending = {}
+
+    @staticmethod
+    def _collection_of(event) -> str:
+        if event.command_name == "getMore":
+            return event.command.get("collection")
+        target = event.command.get(event.command_name)
+        return target if isinstance(target, str) else None
+
+    def started(self, event):
+        collection = self._collection_of(event)
+        if collection is not None:
+            self._pending[(event.connection_id, event.request_id)] = collection
+
+    def succeeded(self, event):
+        collection = self._pending.pop((event.connection_id, event.request_id), None)
+        if collection is not None:
+            MONGO_COMMAND_LATENCY.labels(collection, event.command_name).observe(event.duration_micros / 1e6)
+
+    def failed(self, event):
+        collection = self._pending.pop((event.connection_id, event.request_id), None)
+        if collection is not None:
+            MONGO_COMMAND_LATENCY.labels(collection, event.command_name).observe(event.duration_micros / 1e6)
+            MONGO_COMMAND_FAILURES.labels(collection, event.command_name).inc()
+
+
+def record_llm_usage(model: str, elapsed: float, prompt_tokens: int = 0, completion_tokens: int = 0) -> None:
+    """
+    Records latency and token usage of a single LLM call against the current endpoint
+    :param model: Model name reported by the provider
+    :param elapsed: Wall clock duration of the call in seconds
+    :param prompt_tokens:
+    :param completion_tokens:
+    :return:
+    """
+    endpoint = current_endpoint()
+    LLM_LATENCY.labels(endpoint, model).observe(elapsed)
+    if prompt_tokens:
+        LLM_TOKENS.labels(endpoint, model, "prompt").inc(prompt_tokens)
+    if completion_tokens:
+        LLM_TOKENS.labels(endpoint, model, "completion").inc(completion_tokens)
+
+
+def record_openai_response(response, elapsed: float) -> None:
+    """
+    Records a raw OpenAI SDK chat completion (used by the vision calls which bypass langchain)
+    """
+    usage = getattr(response, "usage", None)
+    record_llm_usage(response.model, elapsed,
+                     usage.prompt_tokens if usage else 0,
+                     usage.completion_tokens if usage else 0)
+
+
+def metrics_endpoint(request) -> Response:
+    """
+    Exposes all collected metrics in Prometheus text format. Under gunicorn (PROMETHEUS_MULTIPROC_DIR set by
+    gunicorn.conf.py) the samples of every worker are aggregated.
+    """
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return Response(generate_latest(registry), media_type=CONTENT_TYPE_LATEST)
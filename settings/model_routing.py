@@ -0,0 +1,149 @@
+import json
+import logging
+import math
+import os
+import time
+from typing import NamedTuple
+
+from settings.metrics import LLM_ROUTE_DECISIONS, LLM_ROUTE_LATENCY, LLM_ROUTING_TOKENS
+from settings.resources import get_chat_llm
+from settings.utils import json_cleaner
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# The large model every request class falls back to, same as the chat client's defaults
+LLM_FALLBACK_MODEL = os.environ.get("LLM_FALLBACK_MODEL", "gpt-4o")
+LLM_FALLBACK_MAX_TOKENS = int(os.environ.get("LLM_FALLBACK_MAX_TOKENS", "4000"))
+# false sends every request class straight to the fallback model
+LLM_ROUTING_ENABLED = os.environ.get("LLM_ROUTING_ENABLED", "true").lower() == "true"
+
+# Per request class, the first rule whose max_prompt_tokens covers the estimated prompt is used; prompts larger
+# than every rule go to the fallback model. min_mean_logprob (optional) rejects answers the model was unsure of.
+# Override with LLM_ROUTING_RULES, a JSON document of the same shape or the path of a file holding one.
+DEFAULT_ROUTING_RULES = {
+    "chat": [{"max_prompt_tokens": 3000, "model": "gpt-4o-mini", "max_tokens": 800, "min_mean_logprob": -1.0}],
+    "meal": [{"max_prompt_tokens": 2000, "model": "gpt-4o-mini", "max_tokens": 2500}],
+    "grocery": [{"max_prompt_tokens": 3000, "model": "gpt-4o-mini", "max_tokens": 1200}],
+    "recommendation": [{"max_prompt_tokens": 2000, "model": "gpt-4o-mini", "max_tokens": 1000,
+                        "min_mean_logprob": -1.2}],
+}
+
+
+class Route(NamedTuple):
+    model: str
+    max_tokens: int
+    min_mean_logprob: float = None
+
+
+FALLBACK_ROUTE = Route(LLM_FALLBACK_MODEL, LLM_FALLBACK_MAX_TOKENS)
+
+
+def _load_rules() -> dict:
+    value = os.environ.get("LLM_ROUTING_RULES", "").strip()
+    if not value:
+        return DEFAULT_ROUTING_RULES
+    try:
+        if not value.startswith("{"):
+            with open(value) as f:
+                value = f.read()
+        return json.loads(value)
+    except (OSError, ValueError) as e:
+        logger.error(f"Error in loading LLM_ROUTING_RULES, using the defaults: {str(e)}")
+        return DEFAULT_ROUTING_RULES
+
+
+ROUTING_RULES = _load_rules()
+
+
+def estimate_tokens(text: str) -> int:
+    # ~4 characters per token for English text with the OpenAI tokenizers, close enough to pick a tier
+    return int(math.ceil(len(text) / 4))
+
+
+def choose_route(request_class: str, prompt: str) -> Route:
+    """
+    Picks the model and completion token cap for a prompt of the given request class
+    :param request_class: Name of the prompt chain, e.g. chat or meal
+    :param prompt: Fully formatted prompt
+    :return: Route
+    """
+    if LLM_ROUTING_ENABLED:
+        prompt_tokens = estimate_tokens(prompt)
+        for rule in ROUTING_RULES.get(request_class, []):
+            if prompt_tokens <= rule.get("max_prompt_tokens", float("inf")):
+                return Route(rule["model"], int(rule["max_tokens"]), rule.get("min_mean_logprob"))
+    return FALLBACK_ROUTE
+
+
+def parses_as_json(text: str) -> bool:
+    return not isinstance(json_cleaner(text.strip()), str)
+
+
+def looks_like_list(text: str) -> bool:
+    return text.count(",") >= 2
+
+
+def _mean_logprob(message):
+    content = ((message.response_metadata or {}).get("logprobs") or {}).get("content") or []
+    if not content:
+        return None
+    return sum(token["logprob"] for token in content) / len(content)
+
+
+def _usage(message) -> int:
+    usage = getattr(message, "usage_metadata", None) or {}
+    return usage.get("total_tokens", 0)
+
+
+def _rejection(route: Route, message, validate) -> str:
+    """
+    :return: why the answer of a routed model is not good enough, None when it is
+    """
+    text = message.content if isinstance(message.content, str) else ""
+    if (message.response_metadata or {}).get("finish_reason") == "length":
+        return "truncated"
+    if not text.strip() or (validate is not None and not validate(text)):
+        return "malformed"
+    if route.min_mean_logprob is not None:
+        mean_logprob = _mean_logprob(message)
+        if mean_logprob is not None and mean_logprob < route.min_mean_logprob:
+            return "low_confidence"
+    return None
+
+
+def _invoke(route: Route, prompt: str):
+    kwargs = {"model": route.model, "max_tokens": route.max_tokens}
+    if route.min_mean_logprob is not None:
+        kwargs["logprobs"] = True
+    return get_chat_llm().invoke(prompt, **kwargs)
+
+
+def complete(request_class: str, prompt: str, validate=None) -> str:
+    """
+    Answers a prompt with the routed model, retrying once on the fallback model when the answer is truncated,
+    fails validate, or was generated with low confidence
+    :param request_class: Name of the prompt chain, selects the routing rules
+    :param prompt: Fully formatted prompt
+    :param validate: Optional callable telling whether the answer text is usable
+    :return: answer text
+    """
+    start = time.perf_counter()
+    route = choose_route(request_class, prompt)
+    message = _invoke(route, prompt)
+    outcome = "fallback_only" if route == FALLBACK_ROUTE else "routed"
+
+    if route != FALLBACK_ROUTE:
+        reason = _rejection(route, message, validate)
+        if reason is None:
+            LLM_ROUTING_TOKENS.labels(request_class, "offloaded").inc(_usage(message))
+        else:
+            logger.info(f"Answer of {route.model} for {request_class} rejected ({reason}), "
+                        f"retrying with {FALLBACK_ROUTE.model}")
+            LLM_ROUTING_TOKENS.labels(request_class, "wasted").inc(_usage(message))
+            outcome = f"fallback_{reason}"
+            message = _invoke(FALLBACK_ROUTE, prompt)
+
+    LLM_ROUTE_DECISIONS.labels(request_class, route.model, outcome).inc()
+    LLM_ROUTE_LATENCY.labels(request_class, outcome).observe(time.perf_counter() - start)
+    return message.content
@@ -0,0 +1,213 @@
+import cProfile
+import hmac
+import io
+import logging
+import os
+import pstats
+import random
+import re
+import sys
+import sysconfig
+import tempfile
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import Headers, MutableHeaders
+
+from settings.metrics import request_path, route_template
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# A request is profiled when it carries PROFILING_HEADER set to PROFILING_SECRET, or, with PROFILING_ENABLED,
+# for a PROFILING_SAMPLE_RATE fraction of all requests. With neither configured the middleware is not installed.
+PROFILING_ENABLED = os.environ.get("PROFILING_ENABLED", "false").lower() == "true"
+PROFILING_SECRET = os.environ.get("PROFILING_SECRET", "")
+PROFILING_HEADER = os.environ.get("PROFILING_HEADER", "X-Profile-Token")
+PROFILING_SAMPLE_RATE = float(os.environ.get("PROFILING_SAMPLE_RATE", "0.01"))
+# sample: wall clock stack sampling of every thread (event loop and threadpool), written as folded stacks
+# cprofile: deterministic cProfile of the event loop thread, written as a .prof file
+PROFILING_MODE = os.environ.get("PROFILING_MODE", "sample")
+PROFILING_INTERVAL = float(os.environ.get("PROFILING_INTERVAL", "0.005"))
+PROFILING_DIR = os.environ.get("PROFILING_DIR", os.path.join(tempfile.gettempdir(), "nutrition_ai_profiles"))
+PROFILING_TOP = int(os.environ.get("PROFILING_TOP", "30"))
+
+
+def is_configured() -> bool:
+    return PROFILING_ENABLED or bool(PROFILING_SECRET)
+
+
+_PATH_PREFIXES = ("site-packages" + os.sep, sysconfig.get_paths()["stdlib"] + os.sep, os.getcwd() + os.sep)
+
+
+def _frame_label(code) -> str:
+    filename = code.co_filename
+    for prefix in _PATH_PREFIXES:
+        if prefix in filename:
+            filename = filename.split(prefix, 1)[1]
+            break
+    return f"{code.co_name} ({filename}:{code.co_firstlineno})"
+
+
+def _is_idle(stack: list) -> bool:
+    # Threadpool workers parked on their job queue are not doing anything for anybody
+    return any(code.co_name == "get" and code.co_filename.endswith("queue.py") for code in stack)
+
+
+class StackSampler:
+    """
+    Samples the Python stack of every thread of the process every interval seconds on a background thread.
+    Captures the event loop and the threadpool (pymongo, Azure SDK, run_in_threadpool work) alike. Wall clock
+    based, so time spent waiting on I/O shows up as well. Other requests served concurrently by the same worker
+    are part of the samples too.
+    """
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self) -> None:
+        own_ident = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own_ident:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(frame.f_code)
+                    frame = frame.f_back
+                stack.reverse()
+                if _is_idle(stack):
+                    continue
+                self.stacks[(names.get(ident, str(ident)),) + tuple(_frame_label(code) for code in stack)] += 1
+            self.samples += 1
+
+    def write(self, base_path: str, header: str) -> None:
+        """
+        Writes <base_path>.folded, one "frame;frame;frame count" line per distinct stack (flamegraph.pl, inferno,
+        speedscope), and <base_path>.txt with the hottest frames
+        """
+        with open(base_path + ".folded", "w") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(";".join(stack) + f" {count}\n")
+
+        self_counts = Counter()
+        total_counts = Counter()
+        for stack, count in self.stacks.items():
+            self_counts[stack[-1]] += count
+            for label in set(stack[1:]):
+                total_counts[label] += count
+        total = sum(self.stacks.values()) or 1
+
+        with open(base_path + ".txt", "w") as f:
+            f.write(header)
+            f.write(f"ticks: {self.samples} every {self.interval * 1000:g} ms, thread samples: {total}\n\n")
+            for title, counts in (("self", self_counts), ("total", total_counts)):
+                f.write(f"top {PROFILING_TOP} frames by {title} samples\n")
+                for label, count in counts.most_common(PROFILING_TOP):
+                    f.write(f"{count:>8d} {count * 100 / total:6.1f}%  {label}\n")
+                f.write("\n")
+
+
+class CProfileRecorder:
+    """
+    cProfile around the request on the event loop thread. Exact call counts, but blind to the threadpool and it
+    also sees every coroutine that runs while the request is suspended.
+    """
+
+    def __init__(self):
+        self.profile = cProfile.Profile()
+
+    def start(self) -> None:
+        self.profile.enable()
+
+    def stop(self) -> None:
+        self.profile.disable()
+
+    def write(self, base_path: str, header: str) -> None:
+        """
+        Writes <base_path>.prof (snakeviz, flameprof, gprof2dot) and <base_path>.txt with the pstats summary
+        """
+        self.profile.dump_stats(base_path + ".prof")
+        summary = io.StringIO()
+        stats = pstats.Stats(self.profile, stream=summary)
+        stats.sort_stats("cumulative").print_stats(PROFILING_TOP)
+        stats.sort_stats("tottime").print_stats(PROFILING_TOP)
+        with open(base_path + ".txt", "w") as f:
+            f.write(header)
+            f.write(summary.getvalue())
+
+
+class ProfilingMiddleware:
+    """
+    Pure ASGI middleware profiling opted-in requests. One request is profiled at a time per worker process; others
+    arriving meanwhile are served normally. The response carries an X-Profile-Id header naming the output files
+    in PROFILING_DIR.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self._busy = threading.Lock()
+        self._header = PROFILING_HEADER.lower().encode("latin-1")
+
+    def _requested(self, scope) -> bool:
+        if PROFILING_SECRET:
+            for name, value in scope["headers"]:
+                if name == self._header and hmac.compare_digest(value, PROFILING_SECRET.encode("latin-1")):
+                    return True
+        return PROFILING_ENABLED and random.random() < PROFILING_SAMPLE_RATE
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self._requested(scope) or not self._busy.acquire(blocking=False):
+            await self.app(scope, receive, send)
+            return
+
+        profile_id = f"{datetime.now().strftime('%Y%m%dT%H%M%S')}_{os.getpid()}_{random.getrandbits(32):08x}"
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                MutableHeaders(scope=message).append("X-Profile-Id", profile_id)
+            await send(message)
+
+        path = request_path(scope)
+        recorder = CProfileRecorder() if PROFILING_MODE == "cprofile" else StackSampler(PROFILING_INTERVAL)
+        start = time.perf_counter()
+        recorder.start()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            recorder.stop()
+            elapsed = time.perf_counter() - start
+            self._busy.release()
+            route = route_template(scope, path) if scope.get("route") is not None else path
+            header = (f"{scope['method']} {route} -> {status_code} in {elapsed * 1000:.1f} ms "
+                      f"(pid {os.getpid()}, user agent {Headers(scope=scope).get('user-agent', '-')})\n")
+            route_slug = re.sub(r"[^A-Za-z0-9]+", "_", route).strip("_")
+            base_path = os.path.join(PROFILING_DIR, f"{profile_id}_{scope['method']}_{route_slug}")
+            try:
+                await run_in_threadpool(_write, recorder, base_path, header)
+                logger.info(f"Profile of {scope['method']} {route} written to {base_path}.*")
+            except Exception as e:
+                logger.error(f"Error in writing profile {profile_id}: {str(e)}")
+
+
+def _write(recorder, base_path: str, header: str) -> None:
+    os.makedirs(os.path.dirname(base_path), exist_ok=True)
+    recorder.write(base_path, header)
@@ -0,0 +1,78 @@
+import logging
+import os
+import threading
+
+from settings import model_routing
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+_registry = {}
+
+
+class PromptChain:
+    """
+    A prompt template whose PromptTemplate is built once per process and reused by every request. Runs go through
+    settings.model_routing, which picks the model for the chain's name as request class.
+    """
+
+    def __init__(self, name: str, template: str, validate=None):
+        self.name = name
+        self.template = template
+        self.validate = validate
+        self._chain = None
+        self._lock = threading.Lock()
+
+    def compile(self):
+        if self._chain is None:
+            with self._lock:
+                if self._chain is None:
+                    from langchain.prompts import PromptTemplate
+                    self._chain = PromptTemplate.from_template(self.template)
+                    logger.info(f"Compiled prompt chain: {self.name}")
+        return self._chain
+
+    def reset(self) -> None:
+        with self._lock:
+            self._chain = None
+
+    def run(self, **kwargs) -> str:
+        return model_routing.complete(self.name, self.compile().format(**kwargs), self.validate)
+
+
+def register(name: str, template: str, validate=None) -> PromptChain:
+    """
+    Registers a prompt template at import time. Nothing heavy happens until compile_all() or the first run().
+    :param name: Unique name of the chain, also the request class for model routing
+    :param template: langchain f-string template
+    :param validate: Optional callable telling whether an answer is usable, see model_routing.complete
+    :return: PromptChain
+    """
+    chain = PromptChain(name, template, validate)
+    _registry[name] = chain
+    return chain
+
+
+def compile_all() -> None:
+    """
+    Compiles every registered chain, called from the FastAPI lifespan
+    """
+    for chain in _registry.values():
+        chain.compile()
+
+
+def reset_all() -> None:
+    """
+    Drops compiled templates so the next run() compiles them again
+    """
+    for chain in _registry.values():
+        chain.reset()
+
+
+def _reset_after_fork() -> None:
+    # Locks may be held by a thread that does not exist in the child
+    for chain in _registry.values():
+        chain._lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
@@ -0,0 +1,231 @@
+"""
+Cascading account purge: every document of a user across all collections plus their Azure blob container.
+
+Documents are removed with one delete_many per collection for a whole chunk of users, the collections of a chunk
+in parallel. Containers are deleted asynchronously with bounded concurrency and retries, only for users that had
+documents. Besides the per-user container of settings.utils.get_container_name_from_email, the container named
+after the bare username (where images were uploaded before per-user containers) is deleted once no other user with
+the same username has documents left; otherwise it is reported under legacy_skipped for manual cleanup.
+
+    python -m settings.purge emails.txt          # one email per line, - for stdin
+"""
+import argparse
+import asyncio
+import logging
+import os
+import re
+import sys
+
+from starlette.concurrency import run_in_threadpool
+
+from settings import resources
+from settings.ratelimit import RATE_LIMIT_COLLECTION
+from settings.resources import get_azure_storage_client, get_db
+from settings.retention import CALORIE_DAILY_COLLECTION
+from settings.utils import get_container_name_from_email, get_username_from_email
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Emails per bulk delete and bulk deletes in flight in batch mode
+PURGE_CHUNK_SIZE = int(os.environ.get("PURGE_CHUNK_SIZE", "500"))
+PURGE_CONCURRENCY = int(os.environ.get("PURGE_CONCURRENCY", "4"))
+# Blob containers deleted at the same time, per call of delete_containers
+BLOB_DELETE_CONCURRENCY = int(os.environ.get("BLOB_DELETE_CONCURRENCY", "8"))
+BLOB_DELETE_RETRIES = int(os.environ.get("BLOB_DELETE_RETRIES", "3"))
+BLOB_DELETE_RETRY_BACKOFF = float(os.environ.get("BLOB_DELETE_RETRY_BACKOFF", "0.5"))
+
+# Collections keyed by email_id holding user data
+PURGED_COLLECTIONS = ["nutrition_app_user", "meal_data", "grocery_data", "chat_data",
+                      "nutrition_recommendation_data", "calorie_data", CALORIE_DAILY_COLLECTION]
+
+# Names Azure accepts for a container; legacy usernames outside it never got one
+_CONTAINER_NAME = re.compile(r"[a-z0-9](?:[a-z0-9]|-(?=[a-z0-9])){2,62}")
+
+# Strong references to in-flight background container deletions, asyncio only keeps weak ones
+_background_deletions = set()
+
+
+def _delete_documents(collection_name: str, emails: list) -> tuple:
+    """
+    :return: number of documents deleted, emails that had documents in the collection
+    """
+    collection = get_db()[collection_name]
+    if collection_name == RATE_LIMIT_COLLECTION:
+        # Limiter state only, does not make an account
+        return collection.delete_many({"_id": {"$in": emails}}).deleted_count, []
+    query = {"email_id": {"$in": emails}}
+    found = collection.distinct("email_id", query)
+    return collection.delete_many(query).deleted_count, found
+
+
+async def purge_documents(emails: list) -> tuple:
+    """
+    Deletes every document of the given users, one bulk delete per collection, all collections at once
+    :return: deleted documents per collection, set of the emails that had any document
+    """
+    names = PURGED_COLLECTIONS + [RATE_LIMIT_COLLECTION]
+    results = await asyncio.gather(*(run_in_threadpool(_delete_documents, name, emails) for name in names))
+    found = set()
+    for _, emails_found in results:
+        found.update(emails_found)
+    return {name: count for name, (count, _) in zip(names, results)}, found
+
+
+def _delete_container(container_name: str) -> bool:
+    from azure.core.exceptions import ResourceNotFoundError
+    try:
+        get_azure_storage_client().delete_container(container_name)
+        return True
+    except ResourceNotFoundError:
+        return False
+
+
+def _legacy_container_shared(email: str) -> bool:
+    """
+    True while another user with the same username still has documents and so may have images in the legacy
+    container. Anchored prefix regexes are served by the email_id indexes.
+    """
+    query = {"email_id": {"$regex": f"^{re.escape(get_username_from_email(email))}@"}}
+    return any(get_db()[name].find_one(query, {"_id": 1}) is not None for name in PURGED_COLLECTIONS)
+
+
+async def _delete_container_with_retries(container_name: str) -> bool:
+    for attempt in range(1, BLOB_DELETE_RETRIES + 1):
+        try:
+            return await run_in_threadpool(_delete_container, container_name)
+        except Exception as e:
+            if attempt == BLOB_DELETE_RETRIES:
+                logger.error(f"Giving up deleting container {container_name} after {attempt} attempts: {str(e)}")
+                raise
+            logger.warning(f"Deleting container {container_name} failed (attempt {attempt}): {str(e)}")
+            await asyncio.sleep(BLOB_DELETE_RETRY_BACKOFF * 2 ** (attempt - 1))
+
+
+async def delete_container(email: str) -> bool:
+    """
+    Deletes the user's blob container with exponential backoff
+    :return: False when the user had no container
+    """
+    return await _delete_container_with_retries(get_container_name_from_email(email))
+
+
+async def delete_legacy_container(email: str) -> str:
+    """
+    Deletes the container named after the user's bare username, unless another user with the same username still
+    has documents. Call once the user's own documents are gone.
+    :return: deleted, missing or shared
+    """
+    username = get_username_from_email(email)
+    if not _CONTAINER_NAME.fullmatch(username):
+        return "missing"
+    if await run_in_threadpool(_legacy_container_shared, email):
+        return "shared"
+    return "deleted" if await _delete_container_with_retries(username) else "missing"
+
+
+async def delete_containers(emails: list) -> dict:
+    """
+    Deletes the per-user and legacy containers of many users, at most BLOB_DELETE_CONCURRENCY at a time
+    :return: number of containers deleted, missing and failed, legacy containers deleted and missing, and the
+             legacy containers skipped because other users share them
+    """
+    semaphore = asyncio.Semaphore(BLOB_DELETE_CONCURRENCY)
+
+    async def bounded(delete, email: str):
+        async with semaphore:
+            return await delete(email)
+
+    results, legacy = await asyncio.gather(
+        asyncio.gather(*(bounded(delete_container, email) for email in emails), return_exceptions=True),
+        asyncio.gather(*(bounded(delete_legacy_container, email) for email in emails), return_exceptions=True))
+    skipped = sorted({get_username_from_email(email) for email, result in zip(emails, legacy) if result == "shared"})
+    if skipped:
+        logger.warning(f"Legacy containers shared with other users, not deleted: {', '.join(skipped)}")
+    return {
+        "deleted": sum(result is True for result in results),
+        "missing": sum(result is False for result in results),
+        "failed": sum(isinstance(result, Exception) for result in results + legacy),
+        "legacy_deleted": sum(result == "deleted" for result in legacy),
+        "legacy_missing": sum(result == "missing" for result in legacy),
+        "legacy_skipped": skipped,
+    }
+
+
+def delete_containers_in_background(emails: list) -> None:
+    task = asyncio.create_task(delete_containers(emails))
+    _background_deletions.add(task)
+    task.add_done_callback(_background_deletions.discard)
+    task.add_done_callback(lambda done: done.cancelled() or done.exception())
+
+
+async def drain_background_deletions(timeout: float = 30.0) -> None:
+    """
+    Waits for pending container deletions, called from the lifespan on shutdown
+    """
+    if _background_deletions:
+        logger.info(f"Waiting for {len(_background_deletions)} background container deletions")
+        await asyncio.wait(set(_background_deletions), timeout=timeout)
+
+
+async def purge_users(emails: list, wait_for_containers: bool = False) -> dict:
+    """
+    Purges many users: chunks of PURGE_CHUNK_SIZE emails, PURGE_CONCURRENCY chunks in flight
+    :param emails: Emails of the users to purge, duplicates are ignored
+    :param wait_for_containers: Delete the blob containers before returning instead of in the background
+    :return: users asked for, users found, deleted documents per collection and, when waited for, container
+             results
+    """
+    emails = list(dict.fromkeys(emails))
+    semaphore = asyncio.Semaphore(PURGE_CONCURRENCY)
+
+    async def purge_chunk(chunk: list) -> tuple:
+        async with semaphore:
+            return await purge_documents(chunk)
+
+    chunks = [emails[start:start + PURGE_CHUNK_SIZE] for start in range(0, len(emails), PURGE_CHUNK_SIZE)]
+    documents = {}
+    found = set()
+    for counts, emails_found in await asyncio.gather(*(purge_chunk(chunk) for chunk in chunks)):
+        found.update(emails_found)
+        for name, count in counts.items():
+            documents[name] = documents.get(name, 0) + count
+
+    # Unknown emails must not cost anyone their images
+    purged = [email for email in emails if email in found]
+    result = {"users": len(emails), "found": len(purged), "documents": documents}
+    if wait_for_containers:
+        result["containers"] = await delete_containers(purged)
+    elif purged:
+        delete_containers_in_background(purged)
+    logger.info(f"Purged {len(purged)} of {len(emails)} users: {documents}")
+    return result
+
+
+def _read_emails(path: str) -> list:
+    stream = sys.stdin if path == "-" else open(path)
+    try:
+        return [line.strip() for line in stream if line.strip()]
+    finally:
+        if stream is not sys.stdin:
+            stream.close()
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("emails", help="File with one email per line, - for stdin")
+    args = parser.parse_args(argv)
+
+    try:
+        result = asyncio.run(purge_users(_read_emails(args.emails), wait_for_containers=True))
+    except Exception as e:
+        logger.error(f"Error in purging users: {str(e)}")
+        return 1
+    finally:
+        resources.close_all()
+    logger.info(f"Containers: {result['containers']}")
+    return 1 if result["containers"]["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
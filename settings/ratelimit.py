@@ -0,0 +1,194 @@
+import asyncio
+import logging
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
+
+from fastapi import HTTPException, Request, status
+from pymongo import ReturnDocument
+from starlette.concurrency import run_in_threadpool
+
+from settings.metrics import LLM_ADMISSION_REJECTIONS
+from settings.resources import get_db
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Per-user token bucket: RATE_LIMIT_BURST requests at once, refilled at RATE_LIMIT_PER_MINUTE
+RATE_LIMIT_BURST = float(os.environ.get("RATE_LIMIT_BURST", "5"))
+RATE_LIMIT_PER_MINUTE = float(os.environ.get("RATE_LIMIT_PER_MINUTE", "10"))
+# memory: per worker process, mongo: shared by every worker and instance
+RATE_LIMIT_BACKEND = os.environ.get("RATE_LIMIT_BACKEND", "memory")
+RATE_LIMIT_COLLECTION = "rate_limit_buckets"
+
+# Global admission control for LLM endpoints, per worker process
+LLM_MAX_INFLIGHT = int(os.environ.get("LLM_MAX_INFLIGHT", "16"))
+LLM_MAX_QUEUE = int(os.environ.get("LLM_MAX_QUEUE", "32"))
+LLM_QUEUE_TIMEOUT = float(os.environ.get("LLM_QUEUE_TIMEOUT", "5"))
+LLM_BUSY_RETRY_AFTER = int(os.environ.get("LLM_BUSY_RETRY_AFTER", "5"))
+
+
+class InMemoryTokenBucket:
+    """
+    Token buckets kept in process memory, bounded to max_keys least recently used users
+    """
+
+    def __init__(self, capacity: float, refill_per_second: float, max_keys: int = 100000):
+        self.capacity = capacity
+        self.refill_per_second = refill_per_second
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def acquire(self, key: str, cost: float = 1.0) -> float:
+        """
+        Takes cost tokens from key's bucket
+        :return: 0 when allowed, otherwise seconds until enough tokens are available
+        """
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (self.capacity, now))
+            tokens = min(self.capacity, tokens + (now - updated) * self.refill_per_second)
+            allowed = tokens >= cost
+            if allowed:
+                tokens -= cost
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        return 0.0 if allowed else (cost - tokens) / self.refill_per_second
+
+
+class MongoTokenBucket:
+    """
+    Token buckets shared through MongoDB. Refill and take happen in a single atomic findOneAndUpdate with an
+    update pipeline, so concurrent workers cannot overspend a bucket.
+    """
+
+    def __init__(self, capacity: float, refill_per_second: float, collection_name: str = RATE_LIMIT_COLLECTION):
+        self.capacity = capacity
+        self.refill_per_second = refill_per_second
+        self.collection_name = collection_name
+
+    def ensure_indexes(self) -> None:
+        # An idle bucket is full again after capacity / rate seconds, after that its document is useless
+        get_db()[self.collection_name].create_index(
+            "updated_at", expireAfterSeconds=int(math.ceil(self.capacity / self.refill_per_second)) + 60)
+
+    def acquire(self, key: str, cost: float = 1.0) -> float:
+        now = datetime.now(timezone.utc)
+        elapsed_seconds = {"$divide": [{"$subtract": [now, {"$ifNull": ["$updated_at", now]}]}, 1000]}
+        refilled = {"$min": [self.capacity, {"$add": [{"$ifNull": ["$tokens", self.capacity]},
+                                                      {"$multiply": [elapsed_seconds, self.refill_per_second]}]}]}
+        bucket = get_db()[self.collection_name].find_one_and_update(
+            {"_id": key},
+            [
+                {"$set": {"tokens": refilled, "updated_at": now}},
+                {"$set": {"allowed": {"$gte": ["$tokens", cost]}}},
+                {"$set": {"tokens": {"$cond": ["$allowed", {"$subtract": ["$tokens", cost]}, "$tokens"]}}},
+            ],
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+        return 0.0 if bucket["allowed"] else (cost - bucket["tokens"]) / self.refill_per_second
+
+
+class AdmissionController:
+    """
+    Bounds the LLM calls in flight. Callers queue for a slot; when the queue is full or a slot does not free up
+    within queue_timeout the request is shed instead of piling onto upstream latency.
+    """
+
+    def __init__(self, max_inflight: int, max_queue: int, queue_timeout: float):
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._semaphore = asyncio.Semaphore(max_inflight)
+        self._waiting = 0
+
+    @asynccontextmanager
+    async def slot(self):
+        if self._semaphore.locked() and self._waiting >= self.max_queue:
+            raise _busy("queue_full")
+        self._waiting += 1
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), timeout=self.queue_timeout)
+        except asyncio.TimeoutError:
+            raise _busy("queue_timeout")
+        finally:
+            self._waiting -= 1
+        try:
+            yield
+        finally:
+            self._semaphore.release()
+
+
+def _busy(reason: str) -> HTTPException:
+    LLM_ADMISSION_REJECTIONS.labels(reason).inc()
+    return HTTPException(status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                         detail="Server is busy, please retry shortly",
+                         headers={"Retry-After": str(LLM_BUSY_RETRY_AFTER)})
+
+
+def _client_key(request: Request) -> str:
+    """
+    Identifies the caller by email_id from the header, query or path, falling back to the client address
+    """
+    return (request.headers.get("email-id")
+            or request.query_params.get("email_id")
+            or request.path_params.get("email_id")
+            or request.path_params.get("email")
+            or (request.client.host if request.client else "anonymous"))
+
+
+if RATE_LIMIT_BACKEND == "mongo":
+    limiter = MongoTokenBucket(RATE_LIMIT_BURST, RATE_LIMIT_PER_MINUTE / 60)
+else:
+    limiter = InMemoryTokenBucket(RATE_LIMIT_BURST, RATE_LIMIT_PER_MINUTE / 60)
+admission = AdmissionController(LLM_MAX_INFLIGHT, LLM_MAX_QUEUE, LLM_QUEUE_TIMEOUT)
+
+
+def ensure_indexes() -> None:
+    if isinstance(limiter, MongoTokenBucket):
+        limiter.ensure_indexes()
+
+
+async def charge(request: Request, cost: float = 1.0) -> None:
+    """
+    Takes cost tokens from the caller's bucket, rejecting with 429 and a Retry-After header when they are not
+    available. cost must not exceed the bucket capacity (RATE_LIMIT_BURST).
+    """
+    key = _client_key(request)
+    if isinstance(limiter, MongoTokenBucket):
+        try:
+            retry_after = await run_in_threadpool(limiter.acquire, key, cost)
+        except Exception as e:
+            # Fail open, an unavailable limiter must not take the LLM endpoints down with it
+            logger.error(f"Error in rate limiting {key}: {str(e)}")
+            retry_after = 0.0
+    else:
+        retry_after = limiter.acquire(key, cost)
+    if retry_after > 0:
+        LLM_ADMISSION_REJECTIONS.labels("user_rate_limit").inc()
+        raise HTTPException(status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                            detail="Too many requests, please slow down",
+                            headers={"Retry-After": str(int(math.ceil(retry_after)))})
+
+
+async def llm_rate_limit(request: Request) -> None:
+    """
+    Dependency for endpoints that take an admission slot per LLM call themselves: per-user fair share only
+    """
+    await charge(request)
+
+
+async def llm_admission(request: Request):
+    """
+    Dependency for LLM endpoints: per-user fair share first, then global admission control.
+    Both reject with 429 and a Retry-After header.
+    """
+    await charge(request)
+    async with admission.slot():
+        yield
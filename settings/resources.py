@@ -0,0 +1,103 @@
+import logging
+import os
+import threading
+
+from settings.config import Config
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+DATABASE_NAME = os.environ.get("MONGO_DATABASE", "nutrition_ai")
+
+_lock = threading.Lock()
+_clients = {}
+
+
+def _get_or_create(name: str, factory):
+    client = _clients.get(name)
+    if client is None:
+        with _lock:
+            client = _clients.get(name)
+            if client is None:
+                client = factory()
+                _clients[name] = client
+    return client
+
+
+def get_mongo_client():
+    return _get_or_create("mongo", lambda: Config.get_instance().get_mongo_client())
+
+
+def get_db():
+    return get_mongo_client()[DATABASE_NAME]
+
+
+def get_chat_llm():
+    return _get_or_create("chat_llm", lambda: Config.get_instance().get_openai_chat_connection())
+
+
+def get_vision_llm():
+    return _get_or_create("vision_llm", lambda: Config.get_instance().get_openai_vision_connection())
+
+
+def get_azure_storage_client():
+    return _get_or_create("azure_storage", lambda: Config.get_instance().get_azure_storage_client())
+
+
+class LazyCollection:
+    """
+    Stand-in for a module level pymongo Collection which resolves the real collection on first use, so that
+    importing a router does not open a MongoDB connection.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __getattr__(self, item):
+        return getattr(get_db()[self.name], item)
+
+
+class LazyDatabase:
+    """
+    Stand-in for a module level pymongo Database, see LazyCollection
+    """
+
+    def __getitem__(self, name: str):
+        return get_db()[name]
+
+    def __getattr__(self, item):
+        return getattr(get_db(), item)
+
+
+def open_all() -> None:
+    """
+    Creates every client up front. Called from the FastAPI lifespan, i.e. once per worker process after any fork.
+    """
+    get_mongo_client()
+    get_chat_llm()
+    get_vision_llm()
+    get_azure_storage_client()
+
+
+def close_all() -> None:
+    """
+    Closes and forgets every client so that the next access creates fresh ones
+    """
+    with _lock:
+        mongo_client = _clients.pop("mongo", None)
+        _clients.clear()
+    if mongo_client is not None:
+        mongo_client.close()
+
+
+def _forget_after_fork() -> None:
+    """
+    Drops clients inherited from the parent process without closing them (their sockets still belong to the
+    parent). The next access in the child creates fresh ones, e.g. when gunicorn forks preloaded workers.
+    """
+    global _lock
+    _lock = threading.Lock()
+    _clients.clear()
+
+
+os.register_at_fork(after_in_child=_forget_after_fork)
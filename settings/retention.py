@@ -0,0 +1,302 @@
+"""
+Retention for the high-growth collections.
+
+- calorie_data: complete days are rolled up into calorie_daily (one document per user and date), the raw entries
+  are stamped with rolled_up_at and a TTL index removes them CALORIE_RAW_RETENTION_DAYS later.
+- chat_data: conversations not updated for CHAT_RETENTION_DAYS are archived, then deleted.
+- meal_data, grocery_data, nutrition_recommendation_data, nutrition_app_user and chat_data: superseded duplicate
+  documents per user (written before these collections were upserted) are archived, then deleted.
+- migrate (one-off, before routing reads and writes through the upserts): archives the duplicates of the versioned
+  collections, then builds the unique email_id index the routers rely on.
+
+Archives are gzip-compressed NDJSON (MongoDB relaxed extended JSON) under RETENTION_ARCHIVE_DIR (default
+~/nutrition_ai_archive), one file per collection and run. Every batch is flushed to disk before its documents are
+deleted.
+
+    python -m settings.retention all
+    python -m settings.retention rollup
+    python -m settings.retention archive --dry-run
+    python -m settings.retention migrate
+"""
+import argparse
+import gzip
+import logging
+import os
+import sys
+from datetime import datetime, timedelta, timezone
+
+from bson import ObjectId
+from bson.json_util import RELAXED_JSON_OPTIONS, dumps
+from pymongo.errors import OperationFailure
+
+from settings.resources import get_db
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Days after which a day's calorie entries are rolled up; 1 rolls up every complete day
+CALORIE_ROLLUP_AFTER_DAYS = int(os.environ.get("CALORIE_ROLLUP_AFTER_DAYS", "1"))
+# Raw entries are kept this long after the roll up; the weekly and dashboard views read raw entries
+CALORIE_RAW_RETENTION_DAYS = int(os.environ.get("CALORIE_RAW_RETENTION_DAYS", "30"))
+CHAT_RETENTION_DAYS = int(os.environ.get("CHAT_RETENTION_DAYS", "180"))
+RETENTION_BATCH_SIZE = int(os.environ.get("RETENTION_BATCH_SIZE", "1000"))
+# Archives hold user data, keep them outside the working tree (archive/ is also ignored by git)
+RETENTION_ARCHIVE_DIR = os.environ.get("RETENTION_ARCHIVE_DIR",
+                                       os.path.join(os.path.expanduser("~"), "nutrition_ai_archive"))
+
+CALORIE_DAILY_COLLECTION = "calorie_daily"
+# Same as routers.mongo_crud_data.VERSIONED_COLLECTIONS, one current document per user under a unique email_id
+VERSIONED_COLLECTIONS = ["nutrition_app_user", "meal_data", "grocery_data", "nutrition_recommendation_data"]
+# The collections holding one current document per user
+DEDUPLICATED_COLLECTIONS = VERSIONED_COLLECTIONS + ["chat_data"]
+
+if CALORIE_ROLLUP_AFTER_DAYS + CALORIE_RAW_RETENTION_DAYS < 8:
+    logger.warning("Raw calorie entries expire before they leave the 7 day views, "
+                   "raise CALORIE_RAW_RETENTION_DAYS")
+
+
+def ensure_ttl_index(collection, field: str, seconds: int) -> None:
+    """
+    Creates a TTL index on field, or changes its expireAfterSeconds when the index already exists
+    """
+    try:
+        collection.create_index(field, expireAfterSeconds=seconds)
+    except OperationFailure as e:
+        # IndexOptionsConflict: same key, different expiry
+        if e.code != 85:
+            raise
+        collection.database.command("collMod", collection.name,
+                                    index={"keyPattern": {field: 1}, "expireAfterSeconds": seconds})
+
+
+def ensure_indexes() -> None:
+    db = get_db()
+    ensure_ttl_index(db["calorie_data"], "rolled_up_at", CALORIE_RAW_RETENTION_DAYS * 86400)
+    db[CALORIE_DAILY_COLLECTION].create_index([("email_id", 1), ("date", 1)], unique=True)
+    db["chat_data"].create_index("updated_at")
+
+
+def rollup_claim_pipeline(cutoff_date: str, batch_size: int) -> list:
+    """
+    The (email_id, date) pairs of up to batch_size raw entries not rolled up yet. Also used by the query plan audit.
+    """
+    return [
+        {"$match": {"rolled_up_at": None, "date": {"$lt": cutoff_date}}},
+        {"$limit": batch_size},
+        {"$group": {"_id": {"email_id": "$email_id", "date": "$date"}}},
+    ]
+
+
+def rollup_calories(cutoff_date: str = None, batch_size: int = RETENTION_BATCH_SIZE) -> int:
+    """
+    Rolls up calorie entries dated before cutoff_date into calorie_daily and stamps them with rolled_up_at.
+    Every (email_id, date) pair touched is recomputed from all of its raw entries and replaced, so reruns and
+    entries logged late for an already rolled up day are handled without double counting.
+    :param cutoff_date: YYYY-MM-DD, defaults to CALORIE_ROLLUP_AFTER_DAYS before today
+    :param batch_size: Raw entries claimed per round
+    :return: number of (email_id, date) pairs rolled up
+    """
+    db = get_db()
+    raw = db["calorie_data"]
+    if cutoff_date is None:
+        cutoff_date = str(datetime.now().date() - timedelta(days=CALORIE_ROLLUP_AFTER_DAYS - 1))
+
+    rolled_up = 0
+    while True:
+        # Served by the rolled_up_at TTL index, entries without the field index as null
+        keys = [key["_id"] for key in raw.aggregate(rollup_claim_pipeline(cutoff_date, batch_size))]
+        if not keys:
+            return rolled_up
+
+        # Served by the {email_id, date} index
+        raw.aggregate([
+            {"$match": {"$or": keys}},
+            {"$group": {"_id": {"email_id": "$email_id", "date": "$date"},
+                        "total_calories": {"$sum": "$calorie"}, "entries": {"$sum": 1}}},
+            {"$project": {"_id": 0, "email_id": "$_id.email_id", "date": "$_id.date",
+                          "total_calories": 1, "entries": 1}},
+            {"$merge": {"into": CALORIE_DAILY_COLLECTION, "on": ["email_id", "date"],
+                        "whenMatched": "replace", "whenNotMatched": "insert"}},
+        ])
+        raw.update_many({"$or": keys, "rolled_up_at": None},
+                        {"$set": {"rolled_up_at": datetime.now(timezone.utc)}})
+        rolled_up += len(keys)
+        logger.info(f"Rolled up {rolled_up} user days of calorie entries so far")
+
+
+def load_daily_total(email_id: str, date: str):
+    """
+    :return: rolled up calorie total of a user's day, None when the day has not been rolled up
+    """
+    daily = get_db()[CALORIE_DAILY_COLLECTION].find_one({"email_id": email_id, "date": date},
+                                                        {"_id": 0, "total_calories": 1})
+    return daily["total_calories"] if daily else None
+
+
+def has_daily_totals(email_id: str) -> bool:
+    """
+    :return: whether any day of the user has been rolled up, their raw entries may all have expired since
+    """
+    return get_db()[CALORIE_DAILY_COLLECTION].find_one({"email_id": email_id}, {"_id": 1}) is not None
+
+
+class NdjsonArchive:
+    """
+    Appends documents to a gzip-compressed NDJSON file, flushed to disk after every batch
+    """
+
+    def __init__(self, collection_name: str, reason: str, archive_dir: str = RETENTION_ARCHIVE_DIR):
+        timestamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+        directory = os.path.join(archive_dir, collection_name)
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, f"{collection_name}-{reason}-{timestamp}.ndjson.gz")
+        self._raw = open(self.path, "ab")
+        self._file = gzip.GzipFile(fileobj=self._raw, mode="ab")
+
+    def write_batch(self, documents: list) -> None:
+        self._file.write("".join(dumps(document, json_options=RELAXED_JSON_OPTIONS) + "\n"
+                                 for document in documents).encode("utf-8"))
+        self._file.flush()
+        self._raw.flush()
+        os.fsync(self._raw.fileno())
+
+    def close(self) -> None:
+        self._file.close()
+        self._raw.close()
+
+
+def archive_documents(collection_name: str, query: dict, reason: str, batch_size: int = RETENTION_BATCH_SIZE,
+                      dry_run: bool = False) -> int:
+    """
+    Streams the documents matching query to an NDJSON archive and deletes each batch once it is on disk
+    :return: number of documents archived (matching, with dry_run)
+    """
+    collection = get_db()[collection_name]
+    if dry_run:
+        return collection.count_documents(query)
+
+    archive = None
+    archived = 0
+    batch = []
+    try:
+        for document in collection.find(query, batch_size=batch_size):
+            batch.append(document)
+            if len(batch) < batch_size:
+                continue
+            archive = archive or NdjsonArchive(collection_name, reason)
+            archived += _archive_batch(collection, archive, batch)
+            batch = []
+        if batch:
+            archive = archive or NdjsonArchive(collection_name, reason)
+            archived += _archive_batch(collection, archive, batch)
+    finally:
+        if archive is not None:
+            archive.close()
+            logger.info(f"Archived {archived} {collection_name} documents ({reason}) to {archive.path}")
+    return archived
+
+
+def _archive_batch(collection, archive: NdjsonArchive, batch: list) -> int:
+    archive.write_batch(batch)
+    collection.delete_many({"_id": {"$in": [document["_id"] for document in batch]}})
+    return len(batch)
+
+
+def archive_stale_chats(days: int = CHAT_RETENTION_DAYS, dry_run: bool = False) -> int:
+    """
+    Archives conversations not updated for days. Documents written before updated_at existed are aged by the
+    creation time in their ObjectId.
+    """
+    cutoff = datetime.now(timezone.utc) - timedelta(days=days)
+    query = {"$or": [{"updated_at": {"$lt": cutoff}},
+                     {"updated_at": {"$exists": False}, "_id": {"$lt": ObjectId.from_datetime(cutoff)}}]}
+    return archive_documents("chat_data", query, "stale", dry_run=dry_run)
+
+
+def archive_duplicates(collection_name: str, dry_run: bool = False) -> int:
+    """
+    Archives every document of a user but the current one. For chat_data the latest conversation is kept, for
+    the versioned collections the newest document by _id.
+    """
+    collection = get_db()[collection_name]
+    duplicated = collection.aggregate([
+        {"$group": {"_id": "$email_id", "count": {"$sum": 1}}},
+        {"$match": {"count": {"$gt": 1}}},
+    ], allowDiskUse=True)
+
+    archived = 0
+    superseded = []
+    for user in duplicated:
+        if collection_name == "chat_data":
+            sort = [("updated_at", -1), ("_id", -1)]
+        else:
+            sort = [("_id", -1)]
+        current = collection.find_one({"email_id": user["_id"]}, {"_id": 1}, sort=sort)
+        if current is None:
+            continue
+        superseded += [document["_id"] for document in
+                       collection.find({"email_id": user["_id"], "_id": {"$ne": current["_id"]}}, {"_id": 1})]
+        if len(superseded) >= RETENTION_BATCH_SIZE:
+            archived += archive_documents(collection_name, {"_id": {"$in": superseded}}, "duplicate",
+                                          dry_run=dry_run)
+            superseded = []
+    if superseded:
+        archived += archive_documents(collection_name, {"_id": {"$in": superseded}}, "duplicate", dry_run=dry_run)
+    return archived
+
+
+def migrate_versioned(dry_run: bool = False) -> dict:
+    """
+    Archives the duplicates of every versioned collection, keeping each user's newest document, then builds the
+    unique email_id index. A save racing the index build can add a duplicate, so it is tried twice.
+    :return: duplicates archived per collection (to archive, with dry_run)
+    """
+    db = get_db()
+    counts = {}
+    for name in VERSIONED_COLLECTIONS:
+        counts[name] = archive_duplicates(name, dry_run=dry_run)
+        if dry_run:
+            continue
+        for attempt in (1, 2):
+            try:
+                db[name].create_index("email_id", unique=True)
+                break
+            except OperationFailure as e:
+                if e.code != 11000 or attempt == 2:
+                    raise
+                logger.warning(f"Error in creating the unique email_id index on {name}, retrying: {str(e)}")
+                counts[name] += archive_duplicates(name)
+    return counts
+
+
+def run_archival(dry_run: bool = False) -> dict:
+    counts = {"chat_data.stale": archive_stale_chats(dry_run=dry_run)}
+    for name in DEDUPLICATED_COLLECTIONS:
+        counts[f"{name}.duplicate"] = archive_duplicates(name, dry_run=dry_run)
+    return counts
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("job", choices=["rollup", "archive", "all", "migrate"])
+    parser.add_argument("--dry-run", action="store_true", help="Only count what would be archived")
+    args = parser.parse_args(argv)
+
+    try:
+        ensure_indexes()
+        if args.job in ("rollup", "all") and not args.dry_run:
+            logger.info(f"Rolled up {rollup_calories()} user days of calorie entries")
+        if args.job in ("archive", "all"):
+            for name, count in run_archival(dry_run=args.dry_run).items():
+                logger.info(f"{name}: {count} documents {'to archive' if args.dry_run else 'archived'}")
+        if args.job == "migrate":
+            for name, count in migrate_versioned(dry_run=args.dry_run).items():
+                logger.info(f"{name}: {count} duplicates {'to archive' if args.dry_run else 'archived'}")
+    except Exception as e:
+        logger.error(f"Error in retention job: {str(e)}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,6 +1,8 @@
+import hashlib
 import os
 import logging
 import json
+import re
 
 logger = logging.getLogger(__name__)
 
@@ -12,6 +14,17 @@ def get_username_from_email(email: str) -> str:
     return email.split('@')[0]
 
 
+def get_container_name_from_email(email: str) -> str:
+    """
+    Name of the user's blob container: the username plus a hash of the full email, so that users sharing a
+    username (alice@gmail.com, alice@yahoo.com) never share a container. Azure container names are 3-63
+    lowercase letters, digits and single hyphens.
+    """
+    username = re.sub(r"[^a-z0-9]+", "-", get_username_from_email(email).lower())[:46].strip("-")
+    digest = hashlib.blake2b(email.encode("utf-8"), digest_size=8).hexdigest()
+    return f"{username}-{digest}" if username else digest
+
+
 import json
 import logging
 